@@ -0,0 +1,7 @@
+__author__ = 'Erik Aumayr'
+
+import os
+import sys
+
+# The benchmarks import the analytics components directly from the repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Data handler'))
@@ -0,0 +1,84 @@
+"""
+Generator of synthetic experiments that resemble the measurements of the 5Genesis testbeds: several measurements per experiment,
+each with a number of KPI fields sampled at a fixed rate over several iterations, tagged with the ExecutionId.
+
+Usage: python -m benchmark.generator [--experimentid 1] [--measurements 3] [--fields 4] [--iterations 5] [--rate 1] [--duration 60]
+"""
+
+
+__author__ = 'Erik Aumayr'
+
+
+import argparse
+import numpy as np
+import pandas as pd
+
+
+TAGS = ('ExecutionId', 'host')
+
+
+def generate_experiment(experimentId, measurements=3, fields=4, iterations=5, rate=1.0, duration=60, start='2021-01-01', jitter=0.1, outliers=0.001, seed=0):
+    """
+    Returns a dictionary of data frames, one per measurement (Measurement_0, Measurement_1, ...), with the columns time (ns since the epoch),
+    the tags ExecutionId and host, the _iteration_ field and the KPI fields (field_0, field_1, ...).
+    Parameters:
+    measurements    number of measurements
+    fields          number of KPI fields per measurement; field_0 follows a slow random walk, the others are noisy linear functions of it,
+                    so that correlation, feature selection and prediction have something to find
+    iterations      number of iterations, which split the duration evenly
+    rate            samples per second of each measurement
+    duration        duration of the experiment in seconds
+    jitter          random offset of the time stamps, as fraction of the sampling interval
+    outliers        fraction of samples that are replaced by outliers
+    """
+    rng = np.random.default_rng(seed)
+    n_points = max(int(duration * rate), 1)
+    step = 1e9 / rate
+    start = pd.Timestamp(start).value
+    experiment = {}
+    for i in range(measurements):
+        times = start + np.arange(n_points) * step + rng.uniform(0, step) + rng.normal(0, jitter * step / 3, n_points)
+        df = pd.DataFrame({
+            'time': np.sort(times.astype(np.int64)),
+            'ExecutionId': str(experimentId),
+            'host': f'agent_{i}',
+            '_iteration_': np.arange(n_points) * iterations // n_points
+        })
+        base = np.cumsum(rng.normal(0, 1, n_points)) + 100
+        for j in range(fields):
+            values = base if j == 0 else rng.uniform(-2, 2) * base + rng.normal(0, 5, n_points)
+            spikes = rng.random(n_points) < outliers
+            values = np.where(spikes, values + rng.choice([-1, 1], n_points) * 20 * values.std(), values)
+            df[f'field_{j}'] = values
+        experiment[f'Measurement_{i}'] = df
+    return experiment
+
+
+def generate_database(experiments):
+    """
+    Combines the measurements of several experiments, given as {experimentId: parameters of generate_experiment}.
+    Unless their start is given, the experiments follow each other with a pause of an hour.
+    """
+    measurements = {}
+    start = pd.Timestamp('2021-01-01')
+    for seed, (experimentId, parameters) in enumerate(experiments.items()):
+        parameters = {'seed': seed, 'start': start, **parameters}
+        for name, df in generate_experiment(experimentId, **parameters).items():
+            measurements.setdefault(name, []).append(df)
+        start = pd.Timestamp(parameters['start']) + pd.Timedelta(seconds=parameters.get('duration', 60)) + pd.Timedelta(hours=1)
+    return {name: pd.concat(frames, ignore_index=True).sort_values('time', kind='mergesort', ignore_index=True) for name, frames in measurements.items()}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--experimentid', default='1')
+    parser.add_argument('--measurements', type=int, default=3)
+    parser.add_argument('--fields', type=int, default=4)
+    parser.add_argument('--iterations', type=int, default=5)
+    parser.add_argument('--rate', type=float, default=1.0)
+    parser.add_argument('--duration', type=float, default=60)
+    args = parser.parse_args()
+    experiment = generate_experiment(args.experimentid, args.measurements, args.fields, args.iterations, args.rate, args.duration)
+    for name, df in experiment.items():
+        print(name, df.shape)
+        print(df.head())
@@ -0,0 +1,428 @@
+"""
+Lightweight stand-in for InfluxDB 1.x that serves synthetic experiments (see generator) over the subset of the HTTP API
+that the DataCollector of the data handler uses, so that the analytics stack can be measured without a testbed database.
+
+Endpoints: /ping and /query (GET or POST, parameter q). The response is CSV with Accept: application/csv, and JSON otherwise.
+Supported statements:
+    SHOW MEASUREMENTS [WHERE condition]
+    SHOW TAG VALUES WITH KEY = "tag"
+    SHOW TAG KEYS
+    SHOW FIELD KEYS
+    SELECT distinct(field) AS alias FROM (SELECT * FROM "measurement" [WHERE condition])
+    SELECT * | "field", ... | mean(*) | mean("field") AS "alias", ... FROM "measurement", ...
+        [WHERE condition] [GROUP BY time(interval) [fill(none)]] [LIMIT n] [OFFSET n]
+Conditions combine terms with and, or and parentheses: tag =~ /regex/, tag !~ /regex/, tag = 'value', tag != 'value', field > number, time >= ns.
+Like InfluxDB, LIMIT and OFFSET apply to each measurement, and the rows of several measurements are returned one measurement after the other.
+
+Usage: python -m benchmark.influx_stub [--port 8086] [--sizes 60 600 3600] [--measurements 3] [--fields 4] [--iterations 5] [--rate 1]
+The experiment of each size (duration in seconds) has the ID bench_<size>.
+"""
+
+
+__author__ = 'Erik Aumayr'
+
+
+import argparse
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import pandas as pd
+from benchmark.generator import generate_database, TAGS
+
+
+VERSION = '1.8.stub'
+AGGREGATIONS = {'mean': 'mean', 'sum': 'sum', 'count': 'count', 'min': 'min', 'max': 'max', 'median': 'median'}
+UNITS = {'ns': 1, 'u': 10**3, 'ms': 10**6, 's': 10**9, 'm': 60 * 10**9, 'h': 3600 * 10**9, 'd': 86400 * 10**9, 'w': 604800 * 10**9}
+
+TOKEN = re.compile(r'''\s*(?:(?P<open>\()|(?P<close>\))|(?P<and>and\b)|(?P<or>or\b)|
+    (?P<term>(?P<ident>"[^"]+"|\w+)\s*(?P<op>=~|!~|>=|<=|!=|=|>|<)\s*(?P<value>/(?:[^/\\]|\\.)*/|'(?:[^'\\]|\\.)*'|-?\d+(?:\.\d+)?)))''', re.I | re.X)
+SELECT = re.compile(r'''^SELECT\s+(?P<fields>.+?)\s+FROM\s+(?P<measurements>(?:"[^"]+"|\w+)(?:\s*,\s*(?:"[^"]+"|\w+))*)
+    (?:\s+WHERE\s+(?P<condition>.+?))?(?:\s+GROUP\s+BY\s+time\((?P<interval>\w+)\)(?:\s+fill\(none\))?)?
+    (?:\s+LIMIT\s+(?P<limit>\d+))?(?:\s+OFFSET\s+(?P<offset>\d+))?$''', re.I | re.S | re.X)
+DISTINCT = re.compile(r'''^SELECT\s+distinct\((?P<field>"[^"]+"|\w+)\)\s+AS\s+(?P<alias>"[^"]+"|\w+)\s+FROM\s+
+    \(\s*SELECT\s+\*\s+FROM\s+(?P<measurement>"[^"]+"|\w+)(?:\s+WHERE\s+(?P<condition>.+?))?\s*\)$''', re.I | re.S | re.X)
+SHOW_MEASUREMENTS = re.compile(r'^SHOW\s+MEASUREMENTS(?:\s+WHERE\s+(?P<condition>.+))?$', re.I | re.S)
+SHOW_TAG_VALUES = re.compile(r'^SHOW\s+TAG\s+VALUES\s+WITH\s+KEY\s*=\s*(?P<key>"[^"]+"|\w+)$', re.I)
+FIELD = re.compile(r'^(?:(?P<function>\w+)\((?P<argument>\*|"[^"]+"|\w+)\)|(?P<field>\*|"[^"]+"|\w+))(?:\s+AS\s+(?P<alias>"[^"]+"|\w+))?$', re.I)
+
+
+class QueryError(Exception):
+    """
+    Invalid or unsupported query, answered with status 400 like a parse error of InfluxDB.
+    """
+    pass
+
+
+class StatementError(Exception):
+    """
+    Valid query that cannot be executed (e.g. mean of a string field), returned as error of the statement.
+    """
+    pass
+
+
+def unquote(identifier):
+    return identifier[1:-1] if identifier.startswith('"') and identifier.endswith('"') else identifier
+
+
+def split_top_level(text, separator=','):
+    parts, depth, current = [], 0, ''
+    for character in text:
+        if character == '(':
+            depth += 1
+        elif character == ')':
+            depth -= 1
+        if character == separator and depth == 0:
+            parts.append(current.strip())
+            current = ''
+        else:
+            current += character
+    parts.append(current.strip())
+    return parts
+
+
+def parse_duration(duration):
+    match = re.fullmatch(r'(\d+)(ns|u|ms|s|m|h|d|w)', duration)
+    if not match:
+        raise QueryError(f'invalid duration {duration}')
+    return int(match.group(1)) * UNITS[match.group(2)]
+
+
+def tokenize(condition):
+    tokens, position = [], 0
+    condition = condition.strip()
+    while position < len(condition):
+        match = TOKEN.match(condition, position)
+        if not match or match.end() == position:
+            raise QueryError(f'unsupported condition at: {condition[position:]}')
+        tokens.append((match.lastgroup, match))
+        position = match.end()
+    return tokens
+
+
+def evaluate(condition, df):
+    """
+    Returns the boolean mask of the rows of df that fulfil the condition.
+    """
+    tokens = tokenize(condition)
+    position = 0
+
+    def expression():
+        nonlocal position
+        mask = conjunction()
+        while position < len(tokens) and tokens[position][0] == 'or':
+            position += 1
+            mask = mask | conjunction()
+        return mask
+
+    def conjunction():
+        nonlocal position
+        mask = atom()
+        while position < len(tokens) and tokens[position][0] == 'and':
+            position += 1
+            mask = mask & atom()
+        return mask
+
+    def atom():
+        nonlocal position
+        if position >= len(tokens):
+            raise QueryError('incomplete condition')
+        kind, match = tokens[position]
+        position += 1
+        if kind == 'open':
+            mask = expression()
+            if position >= len(tokens) or tokens[position][0] != 'close':
+                raise QueryError('missing closing parenthesis')
+            position += 1
+            return mask
+        if kind != 'term':
+            raise QueryError(f'unexpected {match.group(0).strip()}')
+        return term(unquote(match.group('ident')), match.group('op'), match.group('value'), df)
+
+    mask = expression()
+    if position != len(tokens):
+        raise QueryError(f'unexpected {tokens[position][1].group(0).strip()}')
+    return mask
+
+
+def text(df, column):
+    """
+    Returns a column as text, tags are categoricals already. Missing tags are empty, like in InfluxDB.
+    """
+    if column not in df.columns:
+        return pd.Series('', index=df.index)
+    return df[column] if pd.api.types.is_categorical_dtype(df[column]) else df[column].astype(str)
+
+
+def term(column, operator, value, df):
+    if value.startswith('/'):
+        if operator not in ('=~', '!~'):
+            raise QueryError(f'regular expressions require =~ or !~, got {operator}')
+        mask = text(df, column).str.contains(value[1:-1].replace('\\/', '/'), regex=True).astype(bool)
+        return ~mask if operator == '!~' else mask
+    if value.startswith("'"):
+        value = value[1:-1].replace("\\'", "'")
+        values = text(df, column)
+    else:
+        value = float(value) if '.' in value else int(value)
+        if column not in df.columns:
+            return pd.Series(False, index=df.index)
+        values = df[column]
+    comparisons = {'=': values.__eq__, '!=': values.__ne__, '>': values.__gt__, '>=': values.__ge__, '<': values.__lt__, '<=': values.__le__}
+    if operator not in comparisons:
+        raise QueryError(f'{operator} requires a regular expression')
+    return comparisons[operator](value)
+
+
+class InfluxStub(ThreadingHTTPServer):
+    """
+    HTTP server that answers InfluxDB queries from a dictionary of data frames, one per measurement (see generator.generate_database).
+    """
+    daemon_threads = True
+
+    def __init__(self, measurements, address=('127.0.0.1', 8086), tags=TAGS):
+        self.tags = set(tags)
+        self.measurements = {}
+        for name, df in measurements.items():
+            df = df.sort_values('time', kind='mergesort', ignore_index=True)
+            for tag in self.tags & set(df.columns):
+                df[tag] = df[tag].astype(str).astype('category')  # Regular expressions are matched once per distinct value
+            self.measurements[name] = df
+        super().__init__(address, StubHandler)
+
+
+    @property
+    def url(self):
+        return f'http://{self.server_address[0]}:{self.server_address[1]}'
+
+
+    def fields(self, measurement):
+        return [column for column in self.measurements[measurement].columns if column != 'time' and column not in self.tags]
+
+
+    def execute(self, query):
+        """
+        Returns a list of (measurement name, data frame) for the query. Raises QueryError or StatementError.
+        """
+        query = query.strip().rstrip(';').strip()
+        match = SHOW_MEASUREMENTS.match(query)
+        if match:
+            names = [name for name, df in sorted(self.measurements.items()) if not match.group('condition') or evaluate(match.group('condition'), df).any()]
+            return [('measurements', pd.DataFrame({'name': names}))] if names else []
+        match = SHOW_TAG_VALUES.match(query)
+        if match:
+            key = unquote(match.group('key'))
+            return [(name, pd.DataFrame({'key': key, 'value': sorted(df[key].dropna().astype(str).unique())}))
+                    for name, df in sorted(self.measurements.items()) if key in self.tags and key in df.columns]
+        if re.match(r'^SHOW\s+TAG\s+KEYS$', query, re.I):
+            return [(name, pd.DataFrame({'tagKey': sorted(self.tags & set(df.columns))})) for name, df in sorted(self.measurements.items())]
+        if re.match(r'^SHOW\s+FIELD\s+KEYS$', query, re.I):
+            return [(name, pd.DataFrame({'fieldKey': sorted(self.fields(name)), 'fieldType': [field_type(df[field]) for field in sorted(self.fields(name))]}))
+                    for name, df in sorted(self.measurements.items())]
+        match = DISTINCT.match(query)
+        if match:
+            return self.select_distinct(unquote(match.group('measurement')), unquote(match.group('field')), unquote(match.group('alias')), match.group('condition'))
+        match = SELECT.match(query)
+        if match:
+            return self.select(match)
+        raise QueryError(f'unsupported query: {query}')
+
+
+    def select_distinct(self, measurement, field, alias, condition):
+        df = self.measurements.get(measurement)
+        if df is None or field not in df.columns:
+            return []
+        if condition:
+            df = df[evaluate(condition, df)]
+        values = df[field].dropna().unique()
+        if len(values) == 0:
+            return []
+        return [(measurement, pd.DataFrame({'time': 0, alias: values}))]
+
+
+    def select(self, match):
+        items = []
+        for item in split_top_level(match.group('fields')):
+            parsed = FIELD.match(item)
+            if not parsed:
+                raise QueryError(f'unsupported field {item}')
+            items.append(parsed)
+        aggregated = [item.group('function') is not None for item in items]
+        if any(aggregated) and not all(aggregated):
+            raise StatementError('mixing aggregate and non-aggregate queries is not supported')
+        interval = parse_duration(match.group('interval')) if match.group('interval') else None
+        if interval and not all(aggregated):
+            raise StatementError('GROUP BY requires at least one aggregate function')
+        limit = int(match.group('limit')) if match.group('limit') else None
+        offset = int(match.group('offset')) if match.group('offset') else 0
+        results = []
+        for measurement in split_top_level(match.group('measurements')):
+            measurement = unquote(measurement)
+            df = self.measurements.get(measurement)
+            if df is None:
+                continue
+            if match.group('condition'):
+                df = df[evaluate(match.group('condition'), df)]
+            if all(aggregated):
+                result = self.aggregate(measurement, df, items, interval)
+            else:
+                columns = []  # (field or tag, name in the result)
+                for item in items:
+                    field = unquote(item.group('field'))
+                    if field == '*':
+                        columns += [(column, column) for column in sorted(self.fields(measurement) + list(self.tags & set(df.columns)))]
+                    else:
+                        columns.append((field, unquote(item.group('alias')) if item.group('alias') else field))
+                result = df.reindex(columns=['time'] + [column for column, _ in columns])
+                result.columns = ['time'] + [name for _, name in columns]
+            result = result.iloc[offset:offset + limit if limit is not None else None]
+            if not result.empty:
+                results.append((measurement, result))
+        return results
+
+
+    def aggregate(self, measurement, df, items, interval):
+        buckets = df['time'] // interval * interval if interval else pd.Series(0, index=df.index)
+        columns = {}
+        for item in items:
+            function = item.group('function').lower()
+            if function not in AGGREGATIONS:
+                raise QueryError(f'undefined function {function}()')
+            argument = unquote(item.group('argument'))
+            fields = [field for field in self.fields(measurement) if pd.api.types.is_numeric_dtype(df[field])] if argument == '*' else [argument]
+            for field in fields:
+                if field not in df.columns:
+                    continue
+                if not pd.api.types.is_numeric_dtype(df[field]):
+                    raise StatementError(f'unsupported {function} iterator type: {field_type(df[field])}')
+                if argument == '*':
+                    name = f'{function}_{field}'
+                else:
+                    name = unquote(item.group('alias')) if item.group('alias') else function
+                columns[name] = df[field].groupby(buckets.to_numpy()).agg(AGGREGATIONS[function])
+        if not columns:
+            return pd.DataFrame()
+        result = pd.DataFrame(columns).dropna(how='all')  # fill(none)
+        result.index.name = 'time'
+        return result.reset_index()
+
+
+def field_type(series):
+    if pd.api.types.is_bool_dtype(series):
+        return 'boolean'
+    if pd.api.types.is_integer_dtype(series):
+        return 'integer'
+    if pd.api.types.is_float_dtype(series):
+        return 'float'
+    return 'string'
+
+
+def to_csv(results):
+    """
+    Formats the results like the CSV output of InfluxDB: the columns name and tags, followed by the columns of the results.
+    """
+    if not results:
+        return b''
+    frames = []
+    for name, df in results:
+        df = df.copy()
+        df.insert(0, 'tags', '', allow_duplicates=True)
+        df.insert(0, 'name', name, allow_duplicates=True)  # SHOW MEASUREMENTS has a name column as well
+        frames.append(df)
+    return pd.concat(frames, ignore_index=True).to_csv(index=False).encode()
+
+
+def to_json(results):
+    statement = {'statement_id': 0}
+    if results:
+        statement['series'] = [{'name': name, 'columns': list(df.columns), 'values': json.loads(df.to_json(orient='values'))} for name, df in results]
+    return json.dumps({'results': [statement]}).encode()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep-alive, like InfluxDB
+    disable_nagle_algorithm = True  # Headers and body are written separately, which would otherwise wait for delayed ACKs
+
+
+    def do_GET(self):
+        self.handle_request(parse_qs(urlparse(self.path).query))
+
+
+    def do_POST(self):
+        parameters = parse_qs(urlparse(self.path).query)
+        length = int(self.headers.get('Content-Length', 0))
+        if length:
+            parameters.update(parse_qs(self.rfile.read(length).decode()))
+        self.handle_request(parameters)
+
+
+    def handle_request(self, parameters):
+        path = urlparse(self.path).path
+        if path == '/ping':
+            return self.respond(204, b'', 'text/plain')
+        if path != '/query':
+            return self.respond(404, b'404 page not found\n', 'text/plain')
+        csv = 'application/csv' in self.headers.get('Accept', '')
+        try:
+            results = self.server.execute(parameters.get('q', [''])[0])
+        except QueryError as e:
+            return self.respond(400, json.dumps({'error': f'error parsing query: {e}'}).encode(), 'application/json')
+        except StatementError as e:
+            if csv:
+                return self.respond(200, f'name,tags,error\n,,"{e}"\n'.encode(), 'application/csv')
+            return self.respond(200, json.dumps({'results': [{'statement_id': 0, 'error': str(e)}]}).encode(), 'application/json')
+        if csv:
+            return self.respond(200, to_csv(results), 'application/csv')
+        return self.respond(200, to_json(results), 'application/json')
+
+
+    def respond(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('X-Influxdb-Version', VERSION)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(measurements, host='127.0.0.1', port=0):
+    """
+    Starts the stand-in in a background thread and returns the server (stop it with shutdown()). Port 0 selects a free port.
+    """
+    server = InfluxStub(measurements, (host, port))
+    threading.Thread(target=server.serve_forever, name='influx-stub', daemon=True).start()
+    return server
+
+
+def benchmark_database(sizes=(60, 600, 3600), measurements=3, fields=4, iterations=5, rate=1.0):
+    """
+    Generates one experiment with the ID bench_<size> for each size (duration in seconds).
+    """
+    return generate_database({f'bench_{size}': {'measurements': measurements, 'fields': fields, 'iterations': iterations, 'rate': rate, 'duration': size}
+                              for size in sizes})
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8086)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[60, 600, 3600])
+    parser.add_argument('--measurements', type=int, default=3)
+    parser.add_argument('--fields', type=int, default=4)
+    parser.add_argument('--iterations', type=int, default=5)
+    parser.add_argument('--rate', type=float, default=1.0)
+    args = parser.parse_args()
+    database = benchmark_database(args.sizes, args.measurements, args.fields, args.iterations, args.rate)
+    for name, df in database.items():
+        print(f'{name}: {len(df)} points', flush=True)
+    server = InfluxStub(database, (args.host, args.port))
+    print(f'Serving experiments {", ".join(f"bench_{size}" for size in args.sizes)} at {server.url}', flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
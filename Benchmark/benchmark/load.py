@@ -0,0 +1,97 @@
+"""
+Load driver for the analytics stack: sends concurrent requests to the endpoints of the analytics services and reports
+the latency (p50, p99) and the throughput of each endpoint for experiments of different sizes.
+
+Start the InfluxDB stand-in (python -m benchmark.influx_stub) and connect the data handler to it (see README), then run
+Usage: python -m benchmark.load [--datasource stub_bench] [--sizes 60 600 3600] [--requests 20] [--concurrency 4] [--endpoints get_data correlate]
+"""
+
+
+__author__ = 'Erik Aumayr'
+
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from timeit import default_timer as timer
+import numpy as np
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+
+URLS = {
+    'data_handler': 'http://localhost:5000',
+    'correlation': 'http://localhost:5001',
+    'prediction': 'http://localhost:5002',
+    'statistical_analysis': 'http://localhost:5003',
+    'feature_selection': 'http://localhost:5004'
+}
+
+# Request (url, parameters) of each endpoint for a data source, an experiment and a target KPI
+ENDPOINTS = {
+    'get_data': lambda urls, datasource, experimentId, target: (f"{urls['data_handler']}/get_data/{datasource}/{experimentId}", {}),
+    'correlate': lambda urls, datasource, experimentId, target: (f"{urls['correlation']}/correlate/fields/{datasource}/{experimentId}", {}),
+    'statistical_analysis': lambda urls, datasource, experimentId, target: (f"{urls['statistical_analysis']}/statistical_analysis/{datasource}", {'experimentid': experimentId, 'kpi': target}),
+    'selection': lambda urls, datasource, experimentId, target: (f"{urls['feature_selection']}/selection/{datasource}/backward/{target}", {'experimentid': experimentId}),
+    'train': lambda urls, datasource, experimentId, target: (f"{urls['prediction']}/train/{datasource}/linreg/{target}", {'experimentid': experimentId})
+}
+
+
+def measure(session, url, params, n_requests, concurrency, timeout=300):
+    """
+    Sends n_requests requests with concurrency parallel clients and returns the latency percentiles (ms), the throughput (requests/s) and the number of errors.
+    """
+    def send(_):
+        start = timer()
+        try:
+            ok = session.get(url, params=params, timeout=timeout).status_code == 200
+        except requests.exceptions.RequestException:
+            ok = False
+        return timer() - start, ok
+
+    start = timer()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(send, range(n_requests)))
+    duration = timer() - start
+    latencies = np.array([latency for latency, _ in results]) * 1000
+    return {
+        'requests': n_requests,
+        'errors': sum(not ok for _, ok in results),
+        'p50 (ms)': np.percentile(latencies, 50),
+        'p99 (ms)': np.percentile(latencies, 99),
+        'throughput (1/s)': n_requests / duration
+    }
+
+
+def run(datasource='stub_bench', sizes=(60, 600, 3600), endpoints=tuple(ENDPOINTS), n_requests=20, concurrency=4, warmup=1, target='field_0', urls=URLS):
+    """
+    Measures each endpoint with the experiment bench_<size> of each size (see influx_stub).
+    """
+    session = requests.Session()
+    session.mount('http://', HTTPAdapter(pool_maxsize=concurrency))
+    rows = {}
+    for endpoint in endpoints:
+        for size in sizes:
+            url, params = ENDPOINTS[endpoint](urls, datasource, f'bench_{size}', target)
+            for _ in range(warmup):
+                measure(session, url, params, 1, 1)
+            rows[(endpoint, size)] = measure(session, url, params, n_requests, concurrency)
+            print(endpoint, size, rows[(endpoint, size)], flush=True)
+    return pd.DataFrame.from_dict(rows, orient='index').rename_axis(['endpoint', 'size (s)'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--datasource', default='stub_bench')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[60, 600, 3600])
+    parser.add_argument('--endpoints', nargs='+', choices=list(ENDPOINTS), default=list(ENDPOINTS))
+    parser.add_argument('--requests', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--target', default='field_0')
+    for service, url in URLS.items():
+        parser.add_argument(f'--{service.replace("_", "-")}', default=url, help=f'URL of the {service.replace("_", " ")} service')
+    args = parser.parse_args()
+    urls = {service: getattr(args, service) for service in URLS}
+    with pd.option_context('display.width', 200, 'display.max_columns', 10):
+        print(run(args.datasource, args.sizes, args.endpoints, args.requests, args.concurrency, args.warmup, args.target, urls))
@@ -0,0 +1,63 @@
+"""
+Benchmark of the time series synchronisation in the data handler: floor-and-merge (synchronize) against
+the sorted as-of alignment (align) on many measurement series with jittered time stamps.
+
+Usage: python -m benchmark.synchronize [--series 12] [--points 20000] [--repeat 5]
+"""
+
+
+__author__ = 'Erik Aumayr'
+
+
+import argparse
+from timeit import default_timer as timer
+import numpy as np
+import pandas as pd
+import benchmark  # noqa: F401, makes the data handler importable
+from data_handler.time_series_matching import synchronize, align
+
+
+def generate_series(n_series, n_points, interval='1s', jitter=0.3, seed=0):
+    """
+    Generates measurement series that are sampled at the same interval, each with a random offset and random jitter,
+    as it happens with agents that report independently.
+    """
+    rng = np.random.default_rng(seed)
+    step = pd.Timedelta(interval).value
+    start = pd.Timestamp('2021-01-01').value
+    series = {}
+    for i in range(n_series):
+        times = start + np.arange(n_points) * step + rng.uniform(0, step) + rng.normal(0, jitter * step / 3, n_points)
+        index = pd.DatetimeIndex(np.sort(times.astype(np.int64)), name='time')
+        series[f'measurement_{i}'] = pd.DataFrame({f'field_{i}': rng.normal(size=n_points)}, index=index)
+    return series
+
+
+def measure(function, repeat):
+    durations = []
+    for _ in range(repeat):
+        start = timer()
+        result = function()
+        durations.append(timer() - start)
+    return min(durations), result
+
+
+def run(n_series=12, n_points=20000, repeat=5, max_lag='1s'):
+    series = generate_series(n_series, n_points)
+    floor_time, floor_result = measure(lambda: synchronize({name: df.copy() for name, df in series.items()}, max_lag=max_lag, merge=True), repeat)
+    asof_time, asof_result = measure(lambda: align(series, tolerance=max_lag, merge=True), repeat)
+    return pd.DataFrame({
+        'seconds': [floor_time, asof_time],
+        'matched rows': [len(floor_result['series']), len(asof_result['series'])]
+    }, index=['synchronize (floor and merge)', 'align (as-of)'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--series', type=int, default=12)
+    parser.add_argument('--points', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--max_lag', default='1s')
+    args = parser.parse_args()
+    print(f'{args.series} series with {args.points} points each')
+    print(run(args.series, args.points, args.repeat, args.max_lag))
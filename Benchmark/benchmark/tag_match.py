@@ -0,0 +1,61 @@
+"""
+Benchmark of the experiment predicates of the data handler queries on databases with many executions: exact tag equality
+(ExecutionId = '12'), the default, against the regular expression (ExecutionId =~ /12/), which has to be evaluated for every
+execution and also matches all executions whose ID contains the requested one (112, 120, 1200, ...).
+Each database is served by the InfluxDB stand-in, which evaluates regular expressions once per distinct tag value.
+
+Usage: python -m benchmark.tag_match [--executions 100 1000 5000] [--requests 20] [--concurrency 1]
+"""
+
+
+__author__ = 'Erik Aumayr'
+
+
+import argparse
+import pandas as pd
+import requests
+from benchmark.generator import generate_database
+from benchmark.influx_stub import serve
+from benchmark.load import measure
+from data_handler.collect_data import experiment_predicate
+
+
+# Statements of the data handler (see DataCollector), with the experiment predicate of the data handler as parameter
+QUERIES = {
+    'measurements': lambda predicate: f'SHOW MEASUREMENTS WHERE {predicate}',
+    'data': lambda predicate: f'SELECT * FROM "Measurement_0", "Measurement_1" WHERE {predicate}'
+}
+
+
+def run(executions=(100, 1000, 5000), n_requests=20, concurrency=1, experimentId='12', duration=5):
+    """
+    Measures each statement with both predicates on a database with each number of executions (IDs 1 to n, duration seconds each).
+    """
+    rows = {}
+    for n_executions in executions:
+        database = generate_database({str(i): {'measurements': 2, 'fields': 2, 'duration': duration} for i in range(1, n_executions + 1)})
+        server = serve(database)
+        session = requests.Session()
+        try:
+            for name, query in QUERIES.items():
+                for match in ('exact', 'regex'):
+                    params = {'db': 'bench', 'q': query(experiment_predicate(experimentId, match))}
+                    result = session.get(f'{server.url}/query', params=params, headers={'Accept': 'application/csv'})
+                    rows[(n_executions, name, match)] = {'rows': max(len(result.text.splitlines()) - 1, 0),
+                                                         **measure(session, f'{server.url}/query', params, n_requests, concurrency)}
+                    print(n_executions, name, match, rows[(n_executions, name, match)], flush=True)
+        finally:
+            server.shutdown()
+            server.server_close()
+    return pd.DataFrame.from_dict(rows, orient='index').rename_axis(['executions', 'query', 'match'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--executions', type=int, nargs='+', default=[100, 1000, 5000])
+    parser.add_argument('--requests', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--experimentid', default='12')
+    args = parser.parse_args()
+    with pd.option_context('display.width', 200, 'display.max_columns', 10):
+        print(run(args.executions, args.requests, args.concurrency, args.experimentid))
@@ -1,12 +1,41 @@
 __author__ = 'Erik Aumayr'
 
-from flask import Flask, request
+from flask import Flask, request, Response
+from werkzeug.http import quote_etag
+import hashlib
 import json
-import requests
-import pandas as pd
+import pyarrow as pa
 from correlation.correlation import correlate_fields, correlate_experiments
+from correlation.compression import Compression, negotiate_encoding
+from correlation.conditional_get import ConditionalGet
 
 app = Flask(__name__)
+Compression(app)
+
+# Last data frames received from the data handler with their ETags, so that unchanged data is neither transferred nor parsed again
+received = ConditionalGet(size=16)
+
+
+def get_data(link, params):
+    """
+    Returns the ETag and the data frame of a data handler request (Arrow format).
+    """
+    return received.get(link, params, parse=lambda r: pa.ipc.open_stream(r.content).read_pandas())
+
+
+def not_modified(data_etag, headers):
+    """
+    Sets the ETag of a correlation response, derived from the ETag of its data and the request, in the headers.
+    Returns a 304 response if the client already holds this version (If-None-Match), otherwise None.
+    """
+    if not data_etag:
+        return None
+    etag = hashlib.sha256(json.dumps([data_etag, request.path, sorted(request.args.items(multi=True)), negotiate_encoding(request)]).encode()).hexdigest()
+    headers['ETag'] = quote_etag(etag)
+    headers['Vary'] = 'Accept-Encoding'  # Also on 304 responses, which are not compressed
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers=headers)
+    return None
 
 
 @app.route('/', methods=['GET'])
@@ -52,14 +81,17 @@ def get_correlate_fields(datasource, experimentId):
         'field': fields,
         'match_series': False,
         'remove_outliers': remove_outliers,
-        'measurement': measurements
+        'measurement': measurements,
+        'format': 'arrow'
     }
-    r = requests.get(link, params=param_dict)
-    data = r.json()
-    df = pd.DataFrame(data)
+    data_etag, df = get_data(link, param_dict)
+    headers = {}
+    unchanged = not_modified(data_etag, headers)
+    if unchanged:
+        return unchanged
     correlations = correlate_fields(df, method=method)
     results = {k: json.loads(v.to_json()) for k, v in correlations.items()}
-    return {"correlation_matrix": results}, 200
+    return {"correlation_matrix": results}, 200, headers
 
 
 @app.route('/correlate/experiments/<string:datasource>/<string:experimentId1>/<string:experimentId2>', methods=['GET'])
@@ -72,14 +104,18 @@ def get_correlate_experiments(datasource, experimentId1, experimentId2):
     param_dict = {
         'field': fields,
         'remove_outliers': remove_outliers,
-        'measurement': measurements
+        'measurement': measurements,
+        'format': 'arrow'
     }
-    r = requests.get(link, params=param_dict)
-    data = r.json()
+    data_etag, data = get_data(link, param_dict)
+    headers = {}
+    unchanged = not_modified(data_etag, headers)
+    if unchanged:
+        return unchanged
     series = {}
-    for s_name, s in data.items():
-        series[s_name] = pd.DataFrame(s)
-    return {"correlation_list": json.loads(correlate_experiments(series, method=method).to_json())}, 200
+    for s_name, s in data.groupby(level='series', sort=False):
+        series[s_name] = s.droplevel('series')
+    return {"correlation_list": json.loads(correlate_experiments(series, method=method).to_json())}, 200, headers
 
 
 if __name__ == '__main__':
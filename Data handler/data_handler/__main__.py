@@ -2,18 +2,56 @@ __author__ = 'Erik Aumayr'
 
 from os import environ
 from datetime import datetime
-from flask import Flask, request
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, request, Response, g
+from contextvars import copy_context
+from timeit import default_timer as timer
 import json
 import yaml
 import pandas as pd
-from data_handler.collect_data import DataCollector
-from data_handler.time_series_matching import synchronize
-from data_handler.outlier_detection import remove
+from werkzeug.http import quote_etag
+from data_handler.collect_data import DataCollector, decode_cursor, MATCHES
+from data_handler.time_series_matching import align
+from data_handler.outlier_detection import remove, OutlierFilter, MODES, EXCLUDED
+from data_handler.cache import DataCache, request_key
+from data_handler.disk_cache import DiskCache
+from data_handler.serialization import negotiate_format, encode, fingerprint, MIMETYPES
+from data_handler.compression import Compression, negotiate_encoding
+from data_handler.downsampling import downsample, check as check_downsampling
+from data_handler.singleflight import SingleFlight
+from data_handler.memory import BudgetExceeded
+from data_handler import metrics
+from data_handler.metrics import stage
 
 
 app = Flask(__name__)
 
 
+@app.before_request
+def start_request():
+    g.start = timer()
+    g.endpoint = request.endpoint or 'unknown'
+    metrics.endpoint.set(g.endpoint)
+    metrics.IN_FLIGHT.inc(endpoint=g.endpoint)
+
+
+@app.after_request
+def finish_request(response):
+    metrics.REQUEST_SECONDS.observe(timer() - g.start, endpoint=g.endpoint, status=response.status_code)
+    return response
+
+
+@app.teardown_request
+def teardown_request(error=None):
+    if 'endpoint' in g:
+        metrics.IN_FLIGHT.dec(endpoint=g.endpoint)
+
+
+@app.errorhandler(BudgetExceeded)
+def budget_exceeded(error):
+    return {"error": str(error)}, 413
+
+
 @app.route('/', methods=['GET'])
 def index():
     return {'about': "Data handler for 5Genesis Analytics Component. Visit /help for more info."}, 200
@@ -24,22 +62,62 @@ def index():
 @app.route('/api')
 def get_help():
     response = {
+        "headers": {
+            'Accept-Encoding': "zstd or gzip to compress the responses",
+            'If-None-Match': "ETag of a previous /get_data, /get_data_batch or /get_data_aligned response (304 Not Modified if the data has not changed)"
+        },
         "/get_datasources": "no parameters",
+        "/purge_cache": {
+            "default parameters": {
+                'datasource': "None (only purge the data of this datasource)",
+                'experimentId': "None (only purge the data of this experiment)",
+                'disk': "True (or False to keep the data cached on disk)"
+            }
+        },
+        "/cache_stats": "no parameters",
+        "/ready": "no parameters (progress of the experiment ID index, status 503 while warming up)",
+        "/metrics": "no parameters (request and stage timings, cache and error counts in the Prometheus text format)",
         "/get_all_experimentIds/datasource": "no parameters",
         "/get_experimentIds_for_measurement/datasource/measurement": "no parameters",
-        "/get_measurements_for_experimentId/datasource/experimentId": "no parameters",
+        "/get_measurements_for_experimentId/datasource/experimentId": {
+            "default parameters": {
+                'match': "exact (or regex to match the experiment ID as regular expression)"
+            }
+        },
+        "/get_schema/datasource": {
+            "default parameters": {
+                'measurement': "None (repeated for each measurement, all by default)",
+                'experimentid': "None (only the measurements in which this experiment appears)",
+                'experiments': "True (or False to leave out the experiment IDs of each measurement)"
+            }
+        },
+        "/get_data_batch/datasource": "experimentid (repeated for each experiment), partial: False (or True to leave out experiments without data instead of failing), otherwise same parameters as /get_data",
+        "/get_data_aligned/datasource": "experimentid (repeated for each of at least two experiments, aligned on the time since their start), otherwise same parameters as /get_data",
         "/get_data/datasource/experimentId1(/experimentId2)": {
             "default parameters": {
                 'measurement': "None (individual measurement name, e.g. Throughput_Measures)",
                 'field': "None (field filter, e.g. Throughput (Mbps))",
                 'additional_clause': "None (any InfluxDB clause)",
-                'chunked': "False (or True)",
-                'chunk_size': "10000 (any integer)",
+                'chunked': "False (or True to stream and aggregate the data in chunks)",
+                'chunk_size': "10000 (any integer, rows per chunk)",
                 'match_series': "False (or True)",
-                'remove_outliers': "None (zscore or mad)",
+                'tolerance': "max_lag (maximum time distance of matched data points)",
+                'direction': "nearest (or backward, forward, direction in which data points are matched)",
+                'remove_outliers': "None (zscore, mad, rolling_zscore, hampel or iteration_mad)",
+                'outlier_window': "30 (any integer, window size of rolling_zscore and hampel)",
                 'limit': "None (any integer)",
                 'offset': "None (any integer)",
-                'max_lag': "1s (time lag for synchronisation)"
+                'start': "None (ISO 8601 time or nanoseconds since the epoch, inclusive)",
+                'end': "None (ISO 8601 time or nanoseconds since the epoch, exclusive)",
+                'page_size': "None (any integer, rows per page of a single measurement, single experiment only; the next page is given by the X-Next-Cursor header)",
+                'cursor': "None (X-Next-Cursor of the previous page)",
+                'match': "exact (or regex to match the experiment ID as regular expression in the ExperimentId and ExecutionId tags)",
+                'parallel': "None (True to query the measurements concurrently, False to query them at once; PARALLEL_MEASUREMENTS by default)",
+                'max_lag': "1s (time lag for synchronisation)",
+                'pushdown': "False (or True to aggregate the data into max_lag time buckets in InfluxDB)",
+                'max_points': "None (any integer, maximum number of points per field, single experiment only)",
+                'downsample': "lttb (or minmax, method used to reduce the points to max_points)",
+                'format': "json (or arrow, parquet; alternatively set via the Accept header)"
             },
             'datasource': "uma, athens_iperf, athens_rtt"
         }
@@ -49,9 +127,55 @@ def get_help():
 
 @app.route("/purge_cache", methods=["GET"])
 def purge_cache():
-    global data_cache
-    data_cache = {}
-    return {"message": "Cache purged"}, 200
+    datasource = request.args.get('datasource')
+    experimentId = request.args.get('experimentId')
+    removed = raw_cache.invalidate(datasource=datasource, experimentId=experimentId)
+    removed += derived_cache.invalidate(datasource=datasource, experimentId=experimentId)
+    if disk_cache is not None and request.args.get('disk', 'true').lower() == 'true':
+        removed += disk_cache.invalidate(datasource=datasource, experimentId=experimentId)
+    return {"message": "Cache purged", "removed_entries": removed}, 200
+
+
+@app.route("/cache_stats", methods=["GET"])
+def cache_stats():
+    return {"enabled": enable_cache, "raw_cache": raw_cache.stats(), "derived_cache": derived_cache.stats(), "disk_cache": disk_cache.stats() if disk_cache is not None else None, "coalescing": flight.stats()}, 200
+
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    caches = {'raw': raw_cache.stats(), 'derived': derived_cache.stats()}
+    if disk_cache is not None:
+        caches['disk'] = disk_cache.stats()
+    scraped = []
+    for kind, name, documentation, key in (
+            (metrics.Gauge, 'data_handler_cache_bytes', 'Size of the cached data in bytes.', 'bytes'),
+            (metrics.Gauge, 'data_handler_cache_entries', 'Number of cached entries.', 'entries'),
+            (metrics.Counter, 'data_handler_cache_hits_total', 'Number of cache hits.', 'hits'),
+            (metrics.Counter, 'data_handler_cache_misses_total', 'Number of cache misses.', 'misses'),
+            (metrics.Counter, 'data_handler_cache_evictions_total', 'Number of entries evicted from the cache.', 'evictions')):
+        metric = kind(name, documentation, ['cache'], register=False)  # Collected from the caches at every scrape
+        for cache, stats in caches.items():
+            metric.inc(stats[key], cache=cache)
+        scraped.append(metric)
+    hit_ratio = metrics.Gauge('data_handler_cache_hit_ratio', 'Ratio of cache hits to cache lookups.', ['cache'], register=False)
+    for cache, stats in caches.items():
+        lookups = stats['hits'] + stats['misses']
+        hit_ratio.set(stats['hits'] / lookups if lookups else 0.0, cache=cache)
+    scraped.append(hit_ratio)
+    coalesced = metrics.Counter('data_handler_coalesced_requests_total', 'Number of queries shared by identical concurrent requests.', register=False)
+    coalesced.inc(flight.stats()['coalesced'])
+    index_ready = metrics.Gauge('data_handler_index_ready', 'Whether the experiment ID index of a data source is complete.', ['datasource'], register=False)
+    for datasource, source in sources.items():
+        index_ready.set(int(bool(source.client) and source.index.ready), datasource=datasource)
+    scraped += [coalesced, index_ready]
+    return Response(metrics.render(scraped), mimetype='text/plain; version=0.0.4')
+
+
+@app.route("/ready", methods=["GET"])
+def ready():
+    status = {datasource: source.index.progress() if source.client else {'ready': False, 'error': "Not available"} for datasource, source in sources.items()}
+    all_ready = all(source.index.ready for source in sources.values() if source.client)  # Unavailable sources do not block readiness
+    return {"ready": all_ready, "sources": status}, 200 if all_ready else 503
 
 
 @app.route("/get_datasources", methods=["GET"])
@@ -79,74 +203,371 @@ def get_excutionIds(datasource, measurement):
 def get_measurements(datasource, experimentId):
     if datasource not in sources or not sources[datasource].client:
         return {"error": f"Data source {datasource} is not available."}, 404
-    measurements = getattr(sources[datasource], "get_measurements_for_experimentId")(experimentId)
+    match = request.args.get('match', '').lower() or None
+    if match and match not in MATCHES:
+        return {"error": f"Match {match} is not supported. Use exact or regex."}, 400
+    measurements = getattr(sources[datasource], "get_measurements_for_experimentId")(experimentId, match)
     return {f"Measurements for experimentId {experimentId} on {datasource}": measurements}, 200
 
 
-def retrieve_data(datasource, experimentId, measurements=[], fields=[], match_series=False, remove_outliers=None, additional_clause=None, chunked=False, chunk_size=10000, limit=None, offset=None, max_lag='1s'):
-    start = datetime.now()
+@app.route('/get_schema/<string:datasource>', methods=['GET'])
+def get_schema(datasource):
+    if datasource not in sources or not sources[datasource].client:
+        return {"error": f"Data source {datasource} is not available."}, 404
+    source = sources[datasource]
+    measurements = request.args.getlist('measurement') or None
+    experimentId = request.args.get('experimentid')
+    experiments = request.args.get('experiments', 'true').lower() == 'true'
+    experiments_by_measurement = source.index.get_by_measurement()
+    if experimentId:
+        # From the index, or queried while the index does not know the experiment yet; also matches the ExperimentId tag
+        appears_in = source.get_measurements_for_experimentId(experimentId)
+        measurements = [measurement for measurement in measurements if measurement in appears_in] if measurements else sorted(appears_in)
+    schema = source.schema.get(measurements, experiments_by_measurement if experiments else None)
+    return {"schema": schema, "ready": source.index.ready, "last_update": source.schema.last_update}, 200
+
+
+def collect_data(datasource, experimentId, measurements, fields, additional_clause, chunked, chunk_size, limit, offset, max_lag, pushdown, outlier_filter=None, start=None, end=None, page_size=None, cursor=None, match=None, parallel=None):
+    if page_size:
+        return getattr(sources[datasource], "get_page")(experimentId, measurements=measurements, fields=fields, additional_clause=additional_clause, max_lag=max_lag, pushdown=pushdown, start=start, end=end, page_size=page_size, cursor=cursor, match=match)
+    # Only complete query results are persisted on disk, partial or filtered results (limit, offset, time range, additional clause, outliers removed while streaming) are always queried
+    persist = disk_cache is not None and not (additional_clause or limit or offset or outlier_filter or start is not None or end is not None)
+    if persist:
+        key = request_key(datasource=datasource, experimentId=str(experimentId), measurements=sorted(measurements), fields=sorted(fields), max_lag=max_lag, pushdown=pushdown, match=match)
+        data = disk_cache.get(key)
+        if data is None and fields:  # Project the requested fields from the cached data of all fields
+            data = disk_cache.get(request_key(datasource=datasource, experimentId=str(experimentId), measurements=sorted(measurements), fields=[], max_lag=max_lag, pushdown=pushdown, match=match), columns=fields)
+        if data is not None:
+            print('-- Using data cached on disk', flush=True)
+            return data
+    data = getattr(sources[datasource], "get_data")(experimentId, measurements=measurements, fields=fields, additional_clause=additional_clause, chunked=chunked, chunk_size=chunk_size, limit=limit, offset=offset, max_lag=max_lag, pushdown=pushdown, outlier_filter=outlier_filter, start=start, end=end, match=match, parallel=parallel)
+    if persist and finished(data, disk_cache_settle):
+        disk_cache.put(key, data, datasource=datasource, experimentId=experimentId)
+    return data
+
+
+def finished(data, settle):
+    """
+    Whether the newest data point is older than settle seconds, i.e. the experiment is assumed to have finished and its data will not change.
+    """
+    if type(data) != pd.DataFrame or data.empty or not isinstance(data.index, pd.DatetimeIndex):
+        return False
+    newest = data.index.max()
+    now = pd.Timestamp.now(tz='UTC')
+    if newest.tzinfo is None:
+        now = now.tz_localize(None)
+    return now - newest > pd.Timedelta(seconds=settle)
+
+
+def retrieve_data(datasource, experimentId, measurements=[], fields=[], match_series=False, remove_outliers=None, additional_clause=None, chunked=False, chunk_size=10000, limit=None, offset=None, max_lag='1s', pushdown=False, tolerance=None, direction='nearest', outlier_window=30, start=None, end=None, page_size=None, cursor=None, match=None, parallel=None):
+    """
+    Returns the data of an experiment, or with page_size a tuple of one page of data and the cursor of the next page.
+    """
+    started = datetime.now()
     if datasource not in sources or not sources[datasource].client:
         return None
-    dataid = str(datasource) + str(experimentId) + ''.join(sorted(measurements)) + str(fields) + str(remove_outliers) + str(match_series) + str(additional_clause) + str(max_lag) + str(limit)
-    if enable_cache:
-        global data_cache
-        if dataid not in data_cache:
-            print('-- Retrieving uncached data', flush=True)
-            data = getattr(sources[datasource], "get_data")(experimentId, measurements=measurements, fields=fields, additional_clause=additional_clause, chunked=chunked, chunk_size=chunk_size, limit=limit, offset=offset, max_lag=max_lag)
-            data_cache[dataid] = data
-        else:
-            print('-- Using cached data', flush=True)
-            data = data_cache[dataid]
+    match = match or sources[datasource].match
+    outlier_mode = MODES.get(remove_outliers.lower()) if remove_outliers else None
+    # Neither the iterations nor the tags of the measurements are scored as outliers
+    exclude = EXCLUDED + tuple(sorted(sources[datasource].schema.tag_keys()))
+    # Rolling outlier detection is applied to the raw data before it is bucketed (while it is streamed if chunked), unless InfluxDB aggregates it
+    outlier_filter = OutlierFilter(outlier_mode, outlier_window, exclude=exclude) if not pushdown and not page_size and outlier_mode in (2, 3) else None
+    # Raw data as returned by the collector, and the data derived from it by synchronisation and outlier removal
+    raw_key = request_key(datasource=datasource, experimentId=str(experimentId), measurements=sorted(measurements), fields=list(fields),
+                          additional_clause=additional_clause, chunked=chunked, chunk_size=chunk_size, limit=limit, offset=offset,
+                          max_lag=max_lag, pushdown=pushdown, stream_filter=[outlier_mode, outlier_window] if outlier_filter else None,
+                          start=start, end=end, page_size=page_size, cursor=cursor, match=match)
+    derive = match_series or (outlier_mode is not None and outlier_filter is None)
+    derived_key = request_key(raw=raw_key, match_series=match_series, tolerance=tolerance, direction=direction,
+                              remove_outliers=outlier_mode if outlier_filter is None else None, outlier_window=outlier_window)
+    if enable_cache and derive:
+        data = derived_cache.get(derived_key)
+        if data is not None:
+            print('-- Using cached derived data', flush=True)
+            print(datetime.now() - started, flush=True)
+            return data
+    data = raw_cache.get(raw_key) if enable_cache else None
+    if data is None:
+        print('-- Retrieving uncached data', flush=True)
+        # Concurrent identical requests share one query
+        data = flight.do(raw_key, collect_data, datasource, experimentId, measurements, fields, additional_clause, chunked, chunk_size, limit, offset, max_lag, pushdown, outlier_filter, start, end, page_size, cursor, match, parallel)
+        if enable_cache:
+            raw_cache.put(raw_key, data, datasource=datasource, experimentId=experimentId)
     else:
-        data = getattr(sources[datasource], "get_data")(experimentId, measurements=measurements, fields=fields, additional_clause=additional_clause, chunked=chunked, chunk_size=chunk_size, limit=limit, offset=offset, max_lag=max_lag)
+        print('-- Using cached data', flush=True)
+    if page_size:
+        data, next_cursor = data
     if match_series:
-        data = synchronize(dataframes=data, max_lag=max_lag, merge=True)
-    if remove_outliers:
-        if remove_outliers.lower() == 'zscore':
-            data = remove(data, 0)
-        if remove_outliers.lower() == 'mad':
-            data = remove(data, 1)
-    print(datetime.now() - start, flush=True)
+        with stage('synchronisation', datasource):
+            data = align(dataframes=data, tolerance=tolerance or max_lag, direction=direction, merge=True)
+    if outlier_mode is not None and outlier_filter is None:
+        with stage('outlier_removal', datasource):
+            if type(data) == dict:
+                data = {name: remove(df, outlier_mode, outlier_window, exclude=exclude) for name, df in data.items()}
+            else:
+                data = remove(data, outlier_mode, outlier_window, exclude=exclude)
+    if page_size:
+        data = data, next_cursor
+    if enable_cache and derive:
+        derived_cache.put(derived_key, data, datasource=datasource, experimentId=experimentId)
+    print(datetime.now() - started, flush=True)
     return data
 
 
-@app.route('/get_data/<string:datasource>/<string:experimentId1>', methods=['GET'], defaults={'experimentId2': None})
-@app.route('/get_data/<string:datasource>/<string:experimentId1>/<string:experimentId2>', methods=['GET'])
-def get_data(datasource, experimentId1, experimentId2):
-    measurements = request.args.getlist('measurement')
-    fields = request.args.getlist('field')
-    additional_clause = request.args.get('additional_clause')
+def get_data_args():
+    """
+    Returns the parameters of retrieve_data from the request arguments.
+    """
     chunked = request.args.get('chunked')
-    chunked = chunked.lower() == 'true' if chunked else False
     chunk_size = request.args.get('chunk_size')
-    chunk_size = int(chunk_size) if chunk_size else 10000
     match_series = request.args.get('match_series')
-    match_series = match_series.lower() == 'true' if match_series else False
-    remove_outliers = request.args.get('remove_outliers')  # zscore, mad or None
+    outlier_window = request.args.get('outlier_window')
     limit = request.args.get('limit')
-    if limit:
-        limit = int(limit)
     offset = request.args.get('offset')
-    if offset:
-        offset = int(offset)
-    max_lag = request.args.get('max_lag', '1s')
+    pushdown = request.args.get('pushdown')
+    page_size = request.args.get('page_size')
+    parallel = request.args.get('parallel')
+    return {
+        'measurements': request.args.getlist('measurement'),
+        'fields': request.args.getlist('field'),
+        'match_series': match_series.lower() == 'true' if match_series else False,
+        'remove_outliers': request.args.get('remove_outliers'),  # zscore, mad, rolling_zscore, hampel, iteration_mad or None
+        'additional_clause': request.args.get('additional_clause'),
+        'chunked': chunked.lower() == 'true' if chunked else False,
+        'chunk_size': int(chunk_size) if chunk_size else 10000,
+        'limit': int(limit) if limit else None,
+        'offset': int(offset) if offset else None,
+        'max_lag': request.args.get('max_lag', '1s'),
+        'pushdown': pushdown.lower() == 'true' if pushdown else False,
+        'tolerance': request.args.get('tolerance'),
+        'direction': request.args.get('direction', 'nearest').lower(),
+        'outlier_window': int(outlier_window) if outlier_window else 30,
+        'start': request.args.get('start'),
+        'end': request.args.get('end'),
+        'page_size': int(page_size) if page_size else None,
+        'cursor': request.args.get('cursor'),
+        'match': request.args.get('match', '').lower() or None,
+        'parallel': parallel.lower() == 'true' if parallel else None  # Same result either way, not part of the cache keys
+    }
+
+
+def parse_time(value):
+    """
+    Converts a time parameter (ISO 8601, or nanoseconds since the epoch) into nanoseconds since the epoch. Times without time zone are UTC.
+    """
+    timestamp = pd.Timestamp(int(value)) if value.lstrip('-').isdigit() else pd.Timestamp(value)
+    if timestamp is pd.NaT:
+        raise ValueError(f'Invalid time {value}')
+    return timestamp.value
+
+
+def not_modified(datasource, data, response_format, headers):
+    """
+    Sets the strong ETag of a data response in the headers: a hash of the request (path and parameters, as for the cache key),
+    the representation (format and content encoding) and the fingerprint of the data.
+    Returns a 304 response if the client already holds this version (If-None-Match), otherwise None.
+    """
+    with stage('fingerprint', datasource):
+        etag = request_key(path=request.path, args=sorted(request.args.items(multi=True)), format=response_format, encoding=negotiate_encoding(request), data=fingerprint(data))
+    headers['ETag'] = quote_etag(etag)
+    headers['Vary'] = 'Accept, Accept-Encoding'  # The format may be negotiated with the Accept header, also on 304 responses
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers=headers)
+    return None
+
+
+def check_data_args(args):
+    """
+    Returns an error response for invalid parameters, or None. The start and end times are converted to nanoseconds.
+    """
+    if args['direction'] not in ('nearest', 'backward', 'forward'):
+        return {"error": f"Direction {args['direction']} is not supported. Use nearest, backward or forward."}, 400
+    for name in ('max_lag', 'tolerance'):
+        if args[name] is not None:
+            try:
+                pd.Timedelta(args[name])
+            except ValueError:
+                return {"error": f"Invalid {name} {args[name]}. Use a duration such as 1s, 500ms or 5min."}, 400
+    for name in ('start', 'end'):
+        if args[name] is not None:
+            try:
+                args[name] = parse_time(args[name])
+            except ValueError:
+                return {"error": f"Invalid {name} time {args[name]}. Use ISO 8601 (e.g. 2021-01-01T12:00:00Z) or nanoseconds since the epoch."}, 400
+    if args['match'] and args['match'] not in MATCHES:
+        return {"error": f"Match {args['match']} is not supported. Use exact or regex."}, 400
+    if args['page_size'] is not None:
+        if args['page_size'] < 1:
+            return {"error": "page_size must be positive."}, 400
+        if args['limit'] or args['offset']:
+            return {"error": "page_size and cursor cannot be combined with limit and offset."}, 400
+    if args['cursor'] is not None:
+        if args['page_size'] is None:
+            return {"error": "cursor requires page_size."}, 400
+        try:
+            decode_cursor(args['cursor'])
+        except ValueError as e:
+            return {"error": str(e)}, 400
+    max_points = request.args.get('max_points')
+    if max_points is not None:
+        try:
+            max_points = int(max_points)
+        except ValueError:
+            return {"error": f"max_points must be an integer, got {max_points}."}, 400
+    try:
+        check_downsampling(max_points, request.args.get('downsample', 'lttb').lower())
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    if not negotiate_format(request):
+        return {"error": f"Format {request.args.get('format')} is not supported. Use one of {', '.join(MIMETYPES)}."}, 406
+    return None
+
+
+@app.route('/get_data/<string:datasource>/<string:experimentId1>', methods=['GET'], defaults={'experimentId2': None})
+@app.route('/get_data/<string:datasource>/<string:experimentId1>/<string:experimentId2>', methods=['GET'])
+def get_data(datasource, experimentId1, experimentId2):
+    args = get_data_args()
+    error = check_data_args(args)
+    if error:
+        return error
+    max_points = request.args.get('max_points')
+    max_points = int(max_points) if max_points else None
+    downsample_method = request.args.get('downsample', 'lttb').lower()
+    response_format = negotiate_format(request)
+    if args['page_size'] and experimentId2:
+        return {"error": "Pagination (page_size) is only supported for a single experiment."}, 400
     if not experimentId2:
-        data = retrieve_data(datasource, experimentId1, measurements, fields, match_series, remove_outliers, additional_clause, chunked, chunk_size, limit, offset, max_lag)
-        if type(data) == pd.DataFrame and data.empty or type(data) == dict and data == {}:
+        data = retrieve_data(datasource, experimentId1, **args)
+        if data is None:
+            return {"error": f"Data source {datasource} is currently not available."}, 404
+        headers = {}
+        if args['page_size']:  # An empty page is valid, e.g. at the end of the time range
+            data, next_cursor = data
+            if next_cursor:
+                headers['X-Next-Cursor'] = next_cursor
+        elif type(data) == pd.DataFrame and data.empty or type(data) == dict and data == {}:
             return {"error": f"Data source {datasource} is currently not available."}, 404
-        jsonobjects = {name: json.loads(df.to_json()) for name, df in data.items()}
-        return jsonobjects, 200
+        if max_points:
+            with stage('downsampling', datasource):
+                if type(data) == dict:
+                    data = {name: downsample(df, max_points, downsample_method) for name, df in data.items()}
+                else:
+                    data = downsample(data, max_points, downsample_method)
+        unchanged = not_modified(datasource, data, response_format, headers)
+        if unchanged:
+            return unchanged
+        with stage('encoding', datasource):
+            if response_format != 'json':
+                return Response(encode(data, response_format), mimetype=MIMETYPES[response_format], headers=headers)
+            jsonobjects = {name: json.loads(df.to_json()) for name, df in data.items()}
+        return jsonobjects, 200, headers
     else:
-        series1 = retrieve_data(datasource, experimentId1, measurements, fields, match_series, remove_outliers, additional_clause, chunked, chunk_size, limit, offset, max_lag)
-        if series1 is None:
+        series_dict = retrieve_aligned(datasource, {'series1': experimentId1, 'series2': experimentId2}, args)
+        if series_dict is None:
             return {"error": f"Data source {datasource} is currently not available."}, 404
-        series1.index = series1.index - series1.index.min()
-        series2 = retrieve_data(datasource, experimentId2, measurements, fields, match_series, remove_outliers, additional_clause, chunked, chunk_size, limit, offset, max_lag)
-        series2.index = series2.index - series2.index.min()
-        series_dict = synchronize(dataframes={'series1': series1, 'series2': series2}, max_lag=max_lag, merge=False)
-        for series_name, series in series_dict.items():
-            series_dict[series_name] = json.loads(series.to_json())
-        return series_dict, 200
+        headers = {}
+        unchanged = not_modified(datasource, series_dict, response_format, headers)
+        if unchanged:
+            return unchanged
+        with stage('encoding', datasource):
+            if response_format != 'json':
+                return Response(encode(series_dict, response_format), mimetype=MIMETYPES[response_format], headers=headers)
+            for series_name, series in series_dict.items():
+                series_dict[series_name] = json.loads(series.to_json())
+        return series_dict, 200, headers
+
+
+def as_frame(data):
+    """
+    Returns the data of an experiment as a single data frame, also if the measurements have been merged by match_series ({'series': df}).
+    """
+    if type(data) == dict:
+        return pd.concat(data.values(), axis=1) if data else pd.DataFrame()
+    return data
+
+
+def retrieve_aligned(datasource, experimentIds, args):
+    """
+    Retrieves the experiments ({series name: experimentId}) concurrently and aligns them on the time since the start of each experiment,
+    e.g. to compare repeated executions of a test case. Returns None if the data source is not available.
+    The retrieved data frames may be cached, so each one is shifted on a shallow copy, which shares the data but not the index.
+    """
+    futures = {name: batch_executor.submit(copy_context().run, retrieve_data, datasource, experimentId, **args) for name, experimentId in experimentIds.items()}
+    series = {name: future.result() for name, future in futures.items()}
+    if any(df is None for df in series.values()):
+        return None
+    relative = {}
+    for name, df in series.items():
+        df = as_frame(df).copy(deep=False)
+        df.index = df.index - df.index.min()
+        relative[name] = df
+    with stage('synchronisation', datasource):
+        return align(dataframes=relative, tolerance=args['tolerance'] or args['max_lag'], direction=args['direction'], merge=False)
+
+
+@app.route('/get_data_aligned/<string:datasource>', methods=['GET'])
+def get_data_aligned(datasource):
+    experimentIds = list(dict.fromkeys(request.args.getlist('experimentid')))  # Unique, in the requested order
+    if len(experimentIds) < 2:
+        return {"error": "Must specify at least two experimentIds with experimentid=123&experimentid=456."}, 400
+    if datasource not in sources or not sources[datasource].client:
+        return {"error": f"Data source {datasource} is not available."}, 404
+    args = get_data_args()
+    error = check_data_args(args)
+    if error:
+        return error
+    if args['page_size']:
+        return {"error": "Pagination (page_size) is only supported for a single experiment."}, 400
+    response_format = negotiate_format(request)
+    data = retrieve_aligned(datasource, {experimentId: experimentId for experimentId in experimentIds}, args)
+    if data is None:
+        return {"error": f"Data source {datasource} is currently not available."}, 404
+    headers = {}
+    unchanged = not_modified(datasource, data, response_format, headers)
+    if unchanged:
+        return unchanged
+    with stage('encoding', datasource):
+        if response_format != 'json':
+            return Response(encode(data, response_format, level='experimentid'), mimetype=MIMETYPES[response_format], headers=headers)
+        jsonobjects = {experimentId: json.loads(df.to_json()) for experimentId, df in data.items()}
+    return jsonobjects, 200, headers
+
+
+@app.route('/get_data_batch/<string:datasource>', methods=['GET'])
+def get_data_batch(datasource):
+    experimentIds = list(dict.fromkeys(request.args.getlist('experimentid')))  # Unique, in the requested order
+    if not experimentIds:
+        return {"error": "Must specify at least one experimentId with experimentid=123."}, 400
+    if datasource not in sources or not sources[datasource].client:
+        return {"error": f"Data source {datasource} is not available."}, 404
+    args = get_data_args()
+    error = check_data_args(args)
+    if error:
+        return error
+    if args['page_size']:
+        return {"error": "Pagination (page_size) is only supported by /get_data."}, 400
+    response_format = negotiate_format(request)
+    # The experiments are retrieved concurrently by the shared worker pool, each one checks the cache first
+    # (in a copy of the request context, so that their stage timings are labelled with this endpoint)
+    futures = {experimentId: batch_executor.submit(copy_context().run, retrieve_data, datasource, experimentId, **args) for experimentId in experimentIds}
+    data = {experimentId: future.result() for experimentId, future in futures.items()}
+    if any(df is None for df in data.values()):
+        return {"error": f"Data source {datasource} is currently not available."}, 404
+    data = {experimentId: as_frame(df) for experimentId, df in data.items()}
+    missing = [experimentId for experimentId, df in data.items() if df.empty]
+    if missing and request.args.get('partial', 'false').lower() == 'true':
+        data = {experimentId: df for experimentId, df in data.items() if not df.empty}
+    elif missing:
+        return {"error": f"No data found for experiment(s) {', '.join(missing)} on {datasource}."}, 404
+    headers = {}
+    unchanged = not_modified(datasource, data, response_format, headers)
+    if unchanged:
+        return unchanged
+    with stage('encoding', datasource):
+        if response_format != 'json':
+            return Response(encode(data, response_format, level='experimentid'), mimetype=MIMETYPES[response_format], headers=headers)
+        jsonobjects = {experimentId: json.loads(df.to_json()) for experimentId, df in data.items()}
+    return jsonobjects, 200, headers
 
 
 def get_secrets():
@@ -157,11 +578,45 @@ def get_secrets():
         return None
 
 
-if __name__ == '__main__':
+def create_app():
+    """
+    Connects the data sources and sets up the caches from the environment variables, once per process:
+    python -m data_handler for a single process, or gunicorn "data_handler.__main__:create_app()" with a single worker process and threads.
+    """
+    global sources, flight, batch_executor, enable_cache, disk_cache, disk_cache_settle, raw_cache, derived_cache
+    if int(environ.get("WEB_CONCURRENCY", "1")) > 1:
+        print('-- Warning: the data handler is designed for a single worker process (its caches, index, /purge_cache and /metrics are per process), use WEB_CONCURRENCY=1 and more threads instead', flush=True)
+
     # Get login details from secret
     secrets = get_secrets()
     sources = {}
 
+    # InfluxDB connection pool
+    influx_options = {
+        'timeout': float(environ.get("INFLUX_TIMEOUT", "30")),
+        'pool_size': int(environ.get("INFLUX_POOL_SIZE", "10")),
+        'retries': int(environ.get("INFLUX_RETRIES", "3")),
+        'backoff': float(environ.get("INFLUX_BACKOFF", "0.5")),
+        'workers': int(environ.get("INDEX_WORKERS", "8")),
+        'refresh_interval': float(environ.get("INDEX_REFRESH_INTERVAL", "300")),
+        'refresh_overlap': float(environ.get("INDEX_REFRESH_OVERLAP", "60")),
+        'index_dir': environ.get("INDEX_DIR"),  # Snapshots of the index, restored after a restart
+        'match': environ.get("EXPERIMENT_MATCH", "exact").lower(),  # exact or regex by default
+        'parallel': environ.get("PARALLEL_MEASUREMENTS", "False").lower() == "true",
+        'measurement_workers': int(environ.get("MEASUREMENT_WORKERS", "4"))
+    }
+
+    # Memory of the collected data
+    max_rows = environ.get("MAX_ROWS")
+    max_mb = environ.get("MAX_MB")
+    influx_options.update({
+        'compact_dtypes': environ.get("COMPACT_DTYPES", "True").lower() == "true",
+        'float32': environ.get("COMPACT_FLOAT32", "False").lower() == "true",
+        'max_rows': int(max_rows) if max_rows else None,
+        'max_bytes': int(float(max_mb) * 1024**2) if max_mb else None,
+        'budget_policy': environ.get("BUDGET_POLICY", "error").lower()  # error or aggregate
+    })
+
     if secrets:
         connections = yaml.safe_load(secrets)
 
@@ -169,11 +624,30 @@ if __name__ == '__main__':
 
         for con_name, con_details in connections.items():
             for database in con_details["databases"]:
-                sources[con_name + '_' + database] = DataCollector(con_details["host"], con_details["port"], con_details["user"], con_details["password"], database)
+                sources[con_name + '_' + database] = DataCollector(con_details["host"], con_details["port"], con_details["user"], con_details["password"], database, name=con_name + '_' + database, **influx_options)
+
+    # Coalescing of identical concurrent queries
+    flight = SingleFlight()
+
+    # Worker pool for the experiments of batch requests
+    batch_executor = ThreadPoolExecutor(max_workers=int(environ.get("BATCH_WORKERS", "4")))
 
     # Data cache
-    data_cache = {}
     enable_cache = environ.get("ENABLE_CACHE", "False").lower() == "true"
+    cache_ttl = environ.get("CACHE_TTL")  # seconds
+    # Parquet files of finished experiments (no new data for DISK_CACHE_SETTLE seconds), only if caching is enabled
+    disk_cache_dir = environ.get("DISK_CACHE_DIR")
+    disk_cache_ttl = environ.get("DISK_CACHE_TTL")  # seconds
+    disk_cache_settle = float(environ.get("DISK_CACHE_SETTLE", "3600"))
+    disk_cache = DiskCache(disk_cache_dir, max_bytes=int(float(environ.get("DISK_CACHE_SIZE_MB", "10240")) * 1024**2),
+                           ttl=float(disk_cache_ttl) if disk_cache_ttl else None) if disk_cache_dir and enable_cache else None
+    raw_cache = DataCache(max_bytes=int(float(environ.get("CACHE_SIZE_MB", "512")) * 1024**2), ttl=float(cache_ttl) if cache_ttl else None)
+    derived_cache = DataCache(max_bytes=int(float(environ.get("DERIVED_CACHE_SIZE_MB", "128")) * 1024**2), ttl=float(cache_ttl) if cache_ttl else None)
+
+    # Negotiated compression of the responses (registered last, so that it runs before the request metrics)
+    Compression(app, min_size=int(environ.get("COMPRESS_MIN_SIZE", "1024")), level=int(environ.get("COMPRESS_LEVEL", "6")))
+    return app
 
-    # Start app
-    app.run(host='0.0.0.0', port=5000, debug=False)
+
+if __name__ == '__main__':
+    create_app().run(host='0.0.0.0', port=5000, debug=False)
@@ -0,0 +1,153 @@
+"""
+Bounded in-memory cache for the data retrieved by the data handler.
+"""
+
+
+__author__ = 'Erik Aumayr'
+
+
+from collections import OrderedDict
+from threading import RLock
+import hashlib
+import json
+import time
+import pandas as pd
+
+
+def request_key(**parameters):
+    """
+    Returns a canonical key for the given request parameters: a hash of their JSON representation with sorted names,
+    so that neither the order of the parameters nor the boundaries between their values are ambiguous.
+    Lists whose order does not change the result (e.g. measurements) should be sorted by the caller.
+    """
+    description = json.dumps(parameters, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(description.encode()).hexdigest()
+
+
+def size_of(value):
+    """
+    Estimates the memory footprint of a cached value in bytes. Data frames are measured with memory_usage(deep=True),
+    dictionaries and tuples of data frames (e.g. synchronised series) are summed up.
+    """
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(index=True, deep=True))
+    if isinstance(value, dict):
+        return sum(size_of(item) for item in value.values())
+    if isinstance(value, tuple):  # e.g. a page of data and its cursor
+        return sum(size_of(item) for item in value)
+    return 0
+
+
+class CacheEntry:
+
+    def __init__(self, value, size, datasource=None, experimentId=None, expires=None):
+        self.value = value
+        self.size = size
+        self.datasource = datasource
+        self.experimentId = experimentId
+        self.expires = expires
+
+
+class DataCache:
+    """
+    Least-recently-used cache with a byte budget and an optional time to live per entry.
+    Entries are tagged with their datasource and experiment ID so they can be invalidated selectively.
+    Parameters:
+    max_bytes   memory budget in bytes for all entries together
+    ttl         default time to live of an entry in seconds (None for no expiry)
+    """
+
+    def __init__(self, max_bytes=512 * 1024**2, ttl=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.lock = RLock()
+
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry.expires is not None and entry.expires <= time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry.value
+
+
+    def put(self, key, value, datasource=None, experimentId=None, ttl=None):
+        size = size_of(value)
+        if size > self.max_bytes:  # Would evict everything else and still not fit
+            return False
+        ttl = ttl if ttl is not None else self.ttl
+        expires = time.monotonic() + ttl if ttl else None
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = CacheEntry(value, size, datasource, experimentId, expires)
+            self.size += size
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+        return True
+
+
+    def invalidate(self, datasource=None, experimentId=None):
+        """
+        Removes all entries that match the given datasource and/or experiment ID. Without arguments the whole cache is purged.
+        Returns the number of removed entries.
+        """
+        with self.lock:
+            keys = [key for key, entry in self.entries.items()
+                    if (datasource is None or entry.datasource == datasource)
+                    and (experimentId is None or str(entry.experimentId) == str(experimentId))]
+            for key in keys:
+                self._remove(key)
+        return len(keys)
+
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'bytes': self.size,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations
+            }
+
+
+    def _remove(self, key):
+        entry = self.entries.pop(key)
+        self.size -= entry.size
+
+
+    def __len__(self):
+        return len(self.entries)
+
+
+if __name__ == '__main__':
+    cache = DataCache(max_bytes=3000, ttl=None)
+    for i in range(5):
+        cache.put(f'uma_{i}', pd.DataFrame({'a': range(100)}), datasource='uma', experimentId=i)
+    print(cache.stats())
+    cache.get('uma_4')
+    cache.get('uma_0')
+    print(cache.invalidate(experimentId=4), cache.stats())
@@ -7,87 +7,609 @@ __author__ = 'Erik Aumayr'
 
 
 from influxdb import DataFrameClient
-import urllib
 import pandas as pd
 from tqdm import tqdm
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from io import BytesIO
+import base64
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from threading import Thread, Event
+from contextvars import copy_context
+from datetime import datetime
+import time
+from timeit import default_timer as timer
+from data_handler.experiment_index import ExperimentIndex
+from data_handler.schema_catalog import SchemaCatalog
+from data_handler.memory import MemoryBudget, BudgetExceeded, compact, concat
+from data_handler.outlier_detection import OutlierFilter
+from data_handler.metrics import stage, STAGE_SECONDS, INFLUX_ERRORS, INDEX_LOOKUPS, endpoint
+from data_handler.snapshots import write_json, read_json
+
+
+def influx_duration(max_lag):
+    """
+    Converts a Pandas time offset (e.g. 1s, 10s, 1min) into an InfluxQL duration literal.
+    """
+    nanoseconds = pd.Timedelta(max_lag).value
+    for unit, size in (('h', 3600 * 10**9), ('m', 60 * 10**9), ('s', 10**9), ('ms', 10**6), ('u', 10**3)):
+        if nanoseconds % size == 0:
+            return f'{nanoseconds // size}{unit}'
+    return f'{nanoseconds}ns'
+
+
+MATCHES = ('exact', 'regex')
+
+
+def quote_ident(identifier):
+    """
+    Returns an InfluxQL identifier (e.g. measurement or field key) in double quotes, with quotes and backslashes escaped.
+    """
+    return '"' + str(identifier).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def quote_literal(value):
+    """
+    Returns an InfluxQL string literal in single quotes, with quotes and backslashes escaped.
+    """
+    return "'" + str(value).replace('\\', '\\\\').replace("'", "\\'") + "'"
+
+
+def experiment_predicate(experimentId, match='exact'):
+    """
+    Returns the condition that selects the data of an experiment by its ExperimentId or ExecutionId tag.
+    exact compares the tags with the experiment ID, which InfluxDB answers from its series index. regex matches the experiment ID
+    as regular expression anywhere in the tags, which evaluates every series and also matches other IDs that contain it (12 matches 112).
+    """
+    if match == 'regex':
+        pattern = str(experimentId).replace('/', '\\/')
+        return f'(ExperimentId =~ /{pattern}/ or ExecutionId =~ /{pattern}/)'
+    value = quote_literal(experimentId)
+    return f'(ExperimentId = {value} or ExecutionId = {value})'
+
+
+def encode_cursor(measurement, resume):
+    """
+    Returns the opaque cursor of the next page: the measurement and the time (ns) from which it continues.
+    """
+    return base64.urlsafe_b64encode(json.dumps({'measurement': measurement, 'time': resume}).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    Returns the measurement and the time (ns, or None from its start) of a cursor. Raises ValueError for invalid cursors.
+    """
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return str(position['measurement']), int(position['time']) if position['time'] is not None else None
+    except (TypeError, KeyError, AttributeError, UnicodeError, json.JSONDecodeError, base64.binascii.Error) as e:
+        raise ValueError(f'Invalid cursor {cursor}') from e
 
 
 class DataCollector:
+    """
+    Parameters:
+    timeout     connect and read timeout in seconds for InfluxDB requests
+    pool_size   maximum number of kept-alive connections to InfluxDB, shared by all request threads
+    retries     number of retries of failed connections and server errors, with exponential backoff
+    backoff     backoff factor in seconds between retries (backoff * 2^(retry - 1))
+    workers     number of concurrent queries while building the experiment ID index
+    refresh_interval    seconds between incremental refreshes of the experiment ID index (None or 0 to disable)
+    refresh_overlap     seconds that each refresh reaches back before the last one, to catch late or clock-skewed data
+    compact_dtypes      whether the data types of the collected data are compacted (see memory.compact)
+    float32     whether floats are always stored as float32, even if this loses precision
+    max_rows    maximum number of rows of the data of a request (None for no limit)
+    max_bytes   maximum memory of the data of a request in bytes (None for no limit)
+    budget_policy   error to reject requests that exceed max_rows or max_bytes, or aggregate to aggregate their data in InfluxDB instead
+    name        name of the data source in the metrics (database by default)
+    match       exact or regex, how the experiment ID of a request is matched with the ExperimentId and ExecutionId tags by default
+    parallel    whether the measurements of a request are queried concurrently by default, one query per measurement
+    measurement_workers     number of measurements that are queried concurrently, shared by all requests
+    index_dir   directory in which snapshots of the experiment ID index and schema are kept across restarts (None to build them anew)
+    """
 
-    def __init__(self, host, port, user, password, database):
+    def __init__(self, host, port, user, password, database, timeout=30, pool_size=10, retries=3, backoff=0.5, workers=8, refresh_interval=300, refresh_overlap=60,
+                 compact_dtypes=True, float32=False, max_rows=None, max_bytes=None, budget_policy='error', name=None,
+                 index_dir=None, match='exact',
+                 parallel=False, measurement_workers=4):
+        self.name = name or database
+        self.match = match
+        self.parallel = parallel
+        self.measurement_executor = ThreadPoolExecutor(max_workers=measurement_workers, thread_name_prefix=f'measurements-{database}')
         self.host = host
         self.port = port
         self.user = user
         self.password = password
         self.database = database
+        self.timeout = timeout
+        self.workers = workers
+        self.refresh_interval = refresh_interval
+        self.refresh_overlap = refresh_overlap
+        self.compact_dtypes = compact_dtypes
+        self.float32 = float32
+        self.budget = MemoryBudget(max_rows, max_bytes, budget_policy)
+        self.index = ExperimentIndex()
+        self.schema = SchemaCatalog()
+        self.stop_refresh = Event()
+        self.index_path = None
+        if index_dir:
+            os.makedirs(index_dir, exist_ok=True)
+            self.index_path = os.path.join(index_dir, re.sub(r'[^\w.-]', '_', self.name) + '.json')
+        self.session = requests.Session()
         try:
-            self.client = DataFrameClient(host, port, user, password, database, timeout=30)
+            self.client = DataFrameClient(host, port, user, password, database, timeout=timeout, retries=1, pool_size=pool_size, session=self.session)
+            # Mounted after the client, which mounts its own adapter without backoff
+            retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=(500, 502, 503, 504), raise_on_status=False)
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True, max_retries=retry)
+            self.session.mount('http://', adapter)
+            self.session.mount('https://', adapter)
             self.client.ping()
-            self.experimentIds = self.cache_experimentIds()
-        except requests.exceptions.ConnectTimeout as e:  # Timeout of InfluxDB connection
+            # The index is built in the background, so that the data handler is available right away
+            Thread(target=self.maintain_experimentIds, name=f'index-{database}', daemon=True).start()
+        except requests.exceptions.ConnectionError as e:  # Timeout or refused InfluxDB connection
             print(e)
             self.client = None
 
 
-    def get_data(self, experimentId, measurements=[], fields=[], additional_clause=None, chunked=False, chunk_size=10000, limit=None, offset=None, max_lag="1s"):
+    def get_data(self, experimentId, measurements=[], fields=[], additional_clause=None, chunked=False, chunk_size=10000, limit=None, offset=None, max_lag="1s", pushdown=False, outlier_filter=None, start=None, end=None, match=None, parallel=None):
+        """
+        With pushdown=True, the data is aggregated into time buckets of max_lag by InfluxDB (GROUP BY time) instead of locally.
+        If InfluxDB cannot aggregate the requested fields (e.g. non-numeric fields), the raw data is aggregated locally.
+        With chunked=True, an outlier_filter (outlier_detection.OutlierFilter) removes outliers from the raw data of each chunk before it is aggregated.
+        start and end (ns) restrict the data to the time range start <= time < end.
+        If the data exceeds the memory budget, BudgetExceeded is raised or, with the aggregate policy, the data is aggregated by InfluxDB instead.
+        match (exact or regex, see experiment_predicate) overrides the default matching of the experiment ID.
+        parallel overrides whether the measurements are queried concurrently (see collect_parallel).
+        """
+        match = match or self.match
+        parallel = self.parallel if parallel is None else parallel
         if not measurements:
-            results = self.client.query(f"SHOW measurements WHERE (ExperimentId =~ /{experimentId}/ or ExecutionId =~ /{experimentId}/)")
-            measurements = [item["name"] for item in results["measurements"]]
-        measurements = ", ".join([f'"{item}"' for item in measurements])
-        fields = ', '.join([f'"{item}"' for item in fields]) if fields else '*'
+            measurements = self.get_experiment_measurements(experimentId, match)
+        if not measurements:  # Unknown experiment
+            return pd.DataFrame()
+        quoted = [quote_ident(item) for item in measurements]
+        measurements = ", ".join(quoted)
         limit = f' LIMIT {limit}' if limit else ''
         offset = f' OFFSET {offset}' if offset else ''
-        if not additional_clause:
-            additional_clause = ''
-        df = self.query_df(f'SELECT {fields} FROM {measurements} WHERE (ExperimentId =~ /{experimentId}/ or ExecutionId =~ /{experimentId}/){additional_clause}{limit}{offset}')
-        df = df.set_index('time')
-        df.index = pd.to_datetime(df.index).floor(max_lag)
-        df = df.mean(level=0)  # .dropna(axis=0)
+        condition = self.condition(experimentId, additional_clause, start, end, match)
+        try:
+            if parallel and len(quoted) > 1:
+                df = self.collect_parallel(quoted, fields, condition, chunked, chunk_size, limit, offset, max_lag, pushdown, outlier_filter)
+            else:
+                df = self.collect(measurements, fields, condition, chunked, chunk_size, limit, offset, max_lag, pushdown, outlier_filter)
+        except BudgetExceeded as e:
+            if pushdown or self.budget.policy != 'aggregate':  # Already aggregated by InfluxDB, or not possible
+                raise
+            print(f'-- {e} Aggregating in InfluxDB instead', flush=True)
+            try:
+                df = self.get_aggregated_data(measurements, fields, condition, max_lag, limit, offset)
+            except (requests.exceptions.HTTPError, ValueError):
+                raise e
+            self.budget.check_frame(df)
+        return self.compact_data(df)
+
+
+    def collect(self, measurements, fields, condition, chunked, chunk_size, limit, offset, max_lag, pushdown, outlier_filter):
+        if pushdown:
+            try:
+                df = self.get_aggregated_data(measurements, fields, condition, max_lag, limit, offset)
+                self.budget.check_frame(df)
+                return df
+            except (requests.exceptions.HTTPError, ValueError) as e:
+                print(f'-- Aggregation in InfluxDB failed, aggregating locally: {e}', flush=True)
+        fields = ', '.join([quote_ident(item) for item in fields]) if fields else '*'
+        query = f'SELECT {fields} FROM {measurements} WHERE {condition}{limit}{offset}'
+        if chunked:
+            df = self.bucket_chunks(self.query_df_chunks(query, chunk_size), max_lag, outlier_filter)
+        else:
+            df = self.query_df(query, budget=self.budget)
+            with stage('bucketing', self.name):
+                df = self.bucket_chunks([df], max_lag, outlier_filter)
+        self.budget.check_frame(df)
+        return df
+
+
+    def collect_parallel(self, measurements, fields, condition, chunked, chunk_size, limit, offset, max_lag, pushdown, outlier_filter):
+        """
+        Queries, parses and buckets each measurement concurrently instead of querying all of them at once, so that the latency
+        follows the slowest measurement instead of their sum, and merges the time buckets at the end. The result is the same as that of collect:
+        the data is merged as per-bucket sums and counts, also if it is aggregated by InfluxDB (pushdown).
+        The memory budget applies to the data of each measurement and to the merged data.
+        """
+        futures = [self.measurement_executor.submit(copy_context().run, self.collect_measurement, measurement, fields, condition, chunked, chunk_size, limit, offset, max_lag, pushdown,
+                                                    OutlierFilter(outlier_filter.mode, outlier_filter.window, outlier_filter.threshold, outlier_filter.exclude) if outlier_filter else None)
+                   for measurement in measurements]
+        results = [future.result() for future in futures]
+        results = [(sums, counts) for sums, counts in results if not sums.empty]
+        if not results:
+            return pd.DataFrame()
+        with stage('merging', self.name):
+            df = pd.concat([sums for sums, _ in results]).groupby(level=0).sum() / pd.concat([counts for _, counts in results]).groupby(level=0).sum()
+        self.budget.check_frame(df)
         return df
 
 
+    def collect_measurement(self, measurement, fields, condition, chunked, chunk_size, limit, offset, max_lag, pushdown, outlier_filter):
+        """
+        Returns the per-bucket sums and counts of the data of a measurement, aggregated by InfluxDB with pushdown.
+        """
+        if pushdown:
+            try:
+                sums, counts = self.get_aggregated_sums(measurement, fields, condition, max_lag, limit, offset)
+                self.budget.check_frame(sums)
+                return sums, counts
+            except (requests.exceptions.HTTPError, ValueError) as e:
+                print(f'-- Aggregation of {measurement} in InfluxDB failed, aggregating locally: {e}', flush=True)
+        fields = ', '.join([quote_ident(item) for item in fields]) if fields else '*'
+        query = f'SELECT {fields} FROM {measurement} WHERE {condition}{limit}{offset}'
+        if chunked:
+            return self.bucket_sums(self.query_df_chunks(query, chunk_size), max_lag, outlier_filter)
+        df = self.query_df(query, budget=self.budget)
+        with stage('bucketing', self.name):
+            return self.bucket_sums([df], max_lag, outlier_filter)
+
+
+    def compact_data(self, df):
+        if not self.compact_dtypes:
+            return df
+        with stage('compaction', self.name):
+            return compact(df, self.float32)
+
+
+    def get_page(self, experimentId, measurements=[], fields=[], additional_clause=None, max_lag="1s", pushdown=False, start=None, end=None, page_size=10000, cursor=None, match=None):
+        """
+        Returns one page of at most page_size rows (or time buckets with pushdown) of a single measurement and the cursor of the next page,
+        or None after the last page. The measurements are paged in alphabetical order. Instead of OFFSET, each page continues from the time
+        stored in the cursor (time >= cursor), so that the cost of a page does not depend on its position.
+        A raw page ends before its last time bucket, which may continue on the next page, so that no bucket is split between pages.
+        A bucket with more than page_size raw points is returned completely as a page of its own.
+        """
+        match = match or self.match
+        measurements = sorted(measurements or self.get_experiment_measurements(experimentId, match))
+        measurement, resume = decode_cursor(cursor) if cursor else (measurements[0] if measurements else None, None)
+        if measurement not in measurements:
+            return pd.DataFrame(), None
+        position = measurements.index(measurement)
+        while True:
+            condition = self.condition(experimentId, additional_clause, start if resume is None else resume, end, match)
+            df, resume = self.query_page(quote_ident(measurement), fields, condition, max_lag, pushdown, page_size)
+            if resume is not None:
+                return self.compact_data(df), encode_cursor(measurement, resume)
+            position += 1  # The measurement is complete, the next page starts with the next measurement
+            if position == len(measurements):
+                return self.compact_data(df), None
+            if not df.empty:
+                return self.compact_data(df), encode_cursor(measurements[position], None)
+            measurement = measurements[position]
+
+
+    def query_page(self, measurement, fields, condition, max_lag, pushdown, page_size):
+        """
+        Returns the data of a page and the time (ns) from which the next page continues, or None if the measurement is complete.
+        """
+        if pushdown:
+            try:
+                df = self.get_aggregated_data(measurement, fields, condition, max_lag, limit=f' LIMIT {page_size}')
+                if len(df) < page_size:
+                    return df, None
+                return df, df.index[-1].value + pd.Timedelta(max_lag).value
+            except (requests.exceptions.HTTPError, ValueError) as e:
+                print(f'-- Aggregation in InfluxDB failed, aggregating locally: {e}', flush=True)
+        fields = ', '.join([quote_ident(item) for item in fields]) if fields else '*'
+        df = self.query_df(f'SELECT {fields} FROM {measurement} WHERE {condition} LIMIT {page_size}')
+        if df.empty:
+            return df, None
+        df = df.set_index('time')
+        times = pd.to_datetime(df.index)
+        buckets = times.floor(max_lag)
+        resume = None
+        if len(df) == page_size:
+            complete = buckets < buckets[-1]
+            if complete.any():  # The last bucket is returned by the next page
+                resume = buckets[-1].value
+                df, buckets = df[complete], buckets[complete]
+            else:  # A single bucket exceeds the page, it is read completely so that it is not split between pages
+                resume = buckets[-1].value + pd.Timedelta(max_lag).value
+                df = self.query_df(f'SELECT {fields} FROM {measurement} WHERE {condition} and time < {resume}', budget=self.budget).set_index('time')
+                buckets = pd.to_datetime(df.index).floor(max_lag)
+        df.index = buckets
+        return df.mean(level=0), resume
+
+
+    def get_experiment_measurements(self, experimentId, match=None):
+        return self.show_measurements(experiment_predicate(experimentId, match or self.match))
+
+
+    def show_measurements(self, condition=None):
+        """
+        Returns the names of all measurements, or of those with series that match the condition.
+        """
+        df = self.query_df(f'SHOW MEASUREMENTS WHERE {condition}' if condition else 'SHOW MEASUREMENTS')
+        return list(df.iloc[:, -1]) if not df.empty else []  # The columns are name (always measurements), tags and name
+
+
+    @staticmethod
+    def condition(experimentId, additional_clause=None, start=None, end=None, match='exact'):
+        condition = f'{experiment_predicate(experimentId, match)}{additional_clause or ""}'
+        if start is not None:
+            condition += f' and time >= {start}'
+        if end is not None:
+            condition += f' and time < {end}'
+        return condition
+
+
+    def get_aggregated_data(self, measurements, fields, condition, max_lag="1s", limit='', offset=''):
+        sums, counts = self.get_aggregated_sums(measurements, fields, condition, max_lag, limit, offset)
+        return sums / counts if not sums.empty else sums
+
+
+    def get_aggregated_sums(self, measurements, fields, condition, max_lag="1s", limit='', offset=''):
+        """
+        Returns the per-bucket sums and counts of the data as aggregated by InfluxDB. Buckets of different measurements are combined
+        by adding them up, so that their mean is that of all their values (as for local bucketing) and not the mean of the per-measurement means.
+        """
+        if fields:
+            aggregations = ', '.join([f'sum({quote_ident(item)}) AS {quote_ident("sum_" + item)}, count({quote_ident(item)}) AS {quote_ident("count_" + item)}' for item in fields])
+        else:
+            aggregations = 'sum(*), count(*)'  # Only numeric fields are summed, the columns are named sum_<field> and count_<field>
+        df = self.query_df(f'SELECT {aggregations} FROM {measurements} WHERE {condition} GROUP BY time({influx_duration(max_lag)}) fill(none){limit}{offset}')
+        if 'error' in df.columns:
+            raise ValueError(df['error'].dropna().iloc[0])
+        if df.empty:
+            return df, df
+        df = df.set_index('time')
+        df.index = pd.to_datetime(df.index)
+        sums = df[[column for column in df.columns if column.startswith('sum_')]]
+        sums.columns = [column[len('sum_'):] for column in sums.columns]
+        counts = df.reindex(columns=['count_' + column for column in sums.columns])  # Counts of string fields are left out
+        counts.columns = sums.columns
+        return sums.groupby(level=0).sum(), counts.groupby(level=0).sum()  # Combines the buckets of different measurements
+
+
+    @staticmethod
+    def bucket_chunks(chunks, max_lag="1s", outlier_filter=None):
+        """
+        Floors the time index of each chunk to max_lag and folds it into per-bucket sums and counts right away,
+        so that only the aggregates are kept in memory and not the raw data. Buckets that span several chunks are
+        combined at the end, which results in the same means as bucketing the complete data at once.
+        """
+        sums, counts = DataCollector.bucket_sums(chunks, max_lag, outlier_filter)
+        return sums / counts  # Buckets without values result in 0 / 0 = NaN
+
+
+    @staticmethod
+    def bucket_sums(chunks, max_lag="1s", outlier_filter=None):
+        """
+        Returns the per-bucket sums and counts of the numeric columns of the chunks (see bucket_chunks).
+        """
+        sums, counts = [], []
+        for chunk in chunks:
+            if chunk.empty:
+                continue
+            chunk = chunk.set_index('time')
+            chunk = chunk.select_dtypes(include=['number', 'bool'])
+            if outlier_filter is not None:
+                chunk = chunk[~outlier_filter.mask(chunk)]
+            chunk.index = pd.to_datetime(chunk.index).floor(max_lag)
+            grouped = chunk.groupby(level=0)
+            sums.append(grouped.sum())
+            counts.append(grouped.count())
+        if not sums:
+            return pd.DataFrame(), pd.DataFrame()
+        return pd.concat(sums).groupby(level=0).sum(), pd.concat(counts).groupby(level=0).sum()
+
+
     def get_experimentIds_for_measurement(self, measurement):
-        result = self.client.query(f'SELECT distinct(ExecutionId) as ExecutionId from (SELECT * from "{measurement}")', chunked=False, chunk_size=1000, epoch='ns')
-        return list(result[measurement].iloc[:, 0])
+        """
+        Returns the experiment IDs of a measurement from the index, or from a query that scans the measurement if the index does not know it (yet).
+        """
+        experimentIds = self.index.get_experimentIds(measurement)
+        INDEX_LOOKUPS.inc(datasource=self.name, lookup='experimentIds', result='miss' if experimentIds is None else 'hit')
+        if experimentIds is not None:
+            return experimentIds
+        return self.query_experimentIds(measurement)[1]
 
 
-    def get_measurements_for_experimentId(self, experimentId):
-        result = self.client.query(f'SHOW measurements WHERE ExecutionId =~ /{experimentId}/ or ExperimentId =~ /{experimentId}/', chunked=False, chunk_size=1000, epoch='ns')
-        return [item["name"] for item in list(result['measurements'])]
+    def get_measurements_for_experimentId(self, experimentId, match=None):
+        """
+        Returns the measurements of an experiment from the index, or from a query if the index does not know the experiment ID (yet)
+        or the experiment ID is matched as regular expression.
+        """
+        match = match or self.match
+        if match == 'exact':
+            measurements = self.index.get_measurements(experimentId)
+            INDEX_LOOKUPS.inc(datasource=self.name, lookup='measurements', result='miss' if measurements is None else 'hit')
+            if measurements is not None:
+                return measurements
+        return self.show_measurements(experiment_predicate(experimentId, match))
 
 
     def cache_experimentIds(self):
-        experimentIds = []
-        measurements = [measurement['name'] for measurement in self.client.get_list_measurements()]
-        for measurement in tqdm(measurements, desc="Getting ExecutionIds"):
-            results = self.query_df(f'''SELECT distinct(ExecutionId) as ExecutionId from (SELECT * from "{measurement}")''')
-            if not results.empty:
-                experimentIds += list(results['ExecutionId'].astype(str))
-        return sorted(list(set(experimentIds)))
+        """
+        Builds the experiment ID index. Measurements that store ExecutionId as a tag are resolved with a single
+        SHOW TAG VALUES query on the series index, all others are scanned concurrently with a bounded number of workers.
+        """
+        try:
+            build_start = time.time_ns()
+            measurements = self.show_measurements()
+            self.index.start(len(measurements))
+            tag_values = self.query_df('SHOW TAG VALUES WITH KEY = "ExecutionId"')
+            tagged = set()
+            if not tag_values.empty:
+                for measurement, values in tag_values.groupby('name'):
+                    self.index.add(measurement, values['value'])
+                    tagged.add(measurement)
+            untagged = [measurement for measurement in measurements if measurement not in tagged]
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                futures = [executor.submit(self.query_experimentIds, measurement) for measurement in untagged]
+                for future in tqdm(as_completed(futures), total=len(futures), desc=f"Getting ExecutionIds ({self.database})"):
+                    self.index.add(*future.result())
+            self.index_experiment_tags()
+            self.index.watermark = build_start
+            self.refresh_schema()
+            self.index.finish()
+        except Exception as e:
+            print(e, flush=True)
+            self.index.finish(error=e)
+
+
+    def refresh_experimentIds(self):
+        """
+        Merges the experiment IDs of data that has been written since the last build or refresh into the index.
+        Only the data after the stored watermark is queried, so the cost depends on the new data and not on the size of the database.
+        """
+        refresh_start = time.time_ns()
+        since = self.index.watermark - int(self.refresh_overlap * 1e9)
+        measurements = self.show_measurements()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for measurement, experimentIds in executor.map(lambda measurement: self.query_experimentIds(measurement, since), measurements):
+                self.index.add(measurement, experimentIds, done=False)
+        self.index_experiment_tags()
+        self.index.watermark = refresh_start
+        self.refresh_schema()
+        self.index.last_refresh = datetime.now().isoformat()
 
 
-    def query_df(self, query):
+    def index_experiment_tags(self):
+        """
+        Adds the values of the ExperimentId tag to the measurements of each experiment in the index, which the experiment predicate
+        matches as well. They are answered from the series index of InfluxDB, so they are queried completely with every refresh.
+        """
+        tag_values = self.query_df('SHOW TAG VALUES WITH KEY = "ExperimentId"')
+        if not tag_values.empty:
+            for measurement, values in tag_values.groupby('name'):
+                self.index.add_experiment_tags(measurement, values['value'])
+
+
+    def maintain_experimentIds(self):
+        # A snapshot of a previous process (e.g. before a restart) only needs to be refreshed
+        if self.load_experimentIds() and self.index.ready:
+            self.update_experimentIds()
+        else:
+            self.cache_experimentIds()
+            self.save_experimentIds()
+        if not self.refresh_interval:
+            return
+        while not self.stop_refresh.wait(self.refresh_interval):
+            self.update_experimentIds()
+
+
+    def update_experimentIds(self):
+        try:
+            if self.index.ready:
+                self.refresh_experimentIds()
+            else:  # The initial build failed, e.g. because the database was not reachable
+                self.cache_experimentIds()
+            self.save_experimentIds()
+        except Exception as e:
+            print(e, flush=True)
+
+
+    def load_experimentIds(self):
+        """
+        Restores the index and the schema from the snapshot. Returns whether there was a snapshot.
+        """
+        snapshot = read_json(self.index_path) if self.index_path else None
+        if snapshot is None:
+            return False
+        self.index.restore(snapshot['index'])
+        self.schema.restore(snapshot['schema'])
+        return True
+
+
+    def save_experimentIds(self):
+        if self.index_path:
+            write_json(self.index_path, {'index': self.index.snapshot(), 'schema': self.schema.snapshot()})
+
+
+    def refresh_schema(self):
+        """
+        Merges the field keys (with their types) and tag keys of all measurements into the schema catalog.
+        Both are answered from the series index of InfluxDB without reading any data.
+        """
+        self.schema.update(field_keys=self.query_df('SHOW FIELD KEYS'), tag_keys=self.query_df('SHOW TAG KEYS'))
+        self.schema.last_update = datetime.now().isoformat()
+
+
+    def query_experimentIds(self, measurement, since=None):
+        time_clause = f' WHERE time > {since}' if since is not None else ''
+        results = self.query_df(f'''SELECT distinct(ExecutionId) as ExecutionId from (SELECT * from {quote_ident(measurement)}{time_clause})''')
+        if results.empty:
+            return measurement, []
+        return measurement, list(results['ExecutionId'].astype(str))
+
+
+    def query(self, query, stream=False):
         data = {}
         data['db'] = self.database
         data['u'] = self.user
         data['p'] = self.password
         data['precision'] = 'ns'
         data['q'] = query
-        url_values = urllib.parse.urlencode(data)
-        url = f"http://{self.host}:{self.port}/query?" + url_values
-        request = urllib.request.Request(url, headers={'Accept': 'application/csv'})
-        response = urllib.request.urlopen(request)
-        response_bytestr = response.read()
+        url = f"http://{self.host}:{self.port}/query"
+        try:
+            response = self.session.get(url, params=data, headers={'Accept': 'application/csv'}, timeout=self.timeout, stream=stream)
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            INFLUX_ERRORS.inc(datasource=self.name, error=type(e).__name__)
+            raise
+        return response
+
+
+    def query_df(self, query, budget=None):
+        """
+        With a budget (memory.MemoryBudget) that limits rows or bytes, the response is parsed in chunks and BudgetExceeded is raised
+        as soon as the data exceeds it, before the complete response is held in memory.
+        """
+        if budget is not None and (budget.max_rows is not None or budget.max_bytes is not None):
+            chunks, rows, nbytes = [], 0, 0
+            for chunk in self.query_df_chunks(query):
+                chunk = self.compact_data(chunk)
+                rows += len(chunk)
+                nbytes += int(chunk.memory_usage(index=True, deep=True).sum())
+                budget.check(rows, nbytes)
+                chunks.append(chunk)
+            return concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
+        with stage('influx_query', self.name):
+            response = self.query(query)
+            response_bytestr = response.content
         if response_bytestr:
-            return pd.read_csv(BytesIO(response_bytestr), sep=",", low_memory=False)
+            with stage('csv_parsing', self.name):
+                return pd.read_csv(BytesIO(response_bytestr), sep=",", low_memory=False)
         else:
             return pd.DataFrame()
 
 
+    def query_df_chunks(self, query, chunk_size=10000):
+        """
+        Parses the CSV response while it is streamed from the server and yields data frames of at most chunk_size rows.
+        Transfer and parsing overlap, so they are measured together as the influx_stream stage, without the processing of the chunks.
+        """
+        duration = 0
+        start = timer()
+        try:
+            with self.query(query, stream=True) as response:
+                response.raw.decode_content = True
+                try:
+                    for chunk in pd.read_csv(response.raw, sep=",", chunksize=chunk_size, low_memory=False):
+                        duration += timer() - start
+                        start = None
+                        yield chunk
+                        start = timer()
+                except pd.errors.EmptyDataError:  # Empty response
+                    return
+        finally:
+            if start is not None:
+                duration += timer() - start
+            STAGE_SECONDS.observe(duration, stage='influx_stream', datasource=self.name, endpoint=endpoint.get())
+
+
     def get_all_experimentIds(self):
-        return self.experimentIds
+        return self.index.get_all()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,87 @@
+"""
+Negotiated compression of the HTTP responses: zstd (if the zstandard package is installed) or gzip,
+depending on the Accept-Encoding header of the client. Small and already compressed responses are sent as they are.
+
+This module is shared by all services, which are built separately: the copies in the other services are replaced
+with this file by sync_shared.sh (also run by install.sh before the images are built), so only this file is edited.
+"""
+
+
+__author__ = 'Erik Aumayr'
+
+
+import gzip
+from flask import request
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+COMPRESSIBLE = ('application/json', 'application/vnd.apache.arrow.stream', 'text/')  # Parquet is compressed already
+ENCODINGS = ['zstd', 'gzip'] if zstandard else ['gzip']
+
+
+def negotiate_encoding(request):
+    """
+    Returns the content encoding preferred by the client (zstd before gzip for equal quality), or identity.
+    """
+    return request.accept_encodings.best_match(ENCODINGS, default='identity')
+
+
+def compress(data, encoding, level=6):
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor().compress(data)  # Level 3, faster than gzip and compresses better
+    return gzip.compress(data, compresslevel=level)
+
+
+class Compression:
+    """
+    Compresses the responses of a Flask app.
+    Parameters:
+    min_size    responses smaller than this (in bytes) are not compressed
+    level       compression level of gzip (1-9)
+    """
+
+    def __init__(self, app=None, min_size=1024, level=6):
+        self.min_size = min_size
+        self.level = level
+        if app is not None:
+            self.init_app(app)
+
+
+    def init_app(self, app):
+        app.after_request(self.after_request)
+
+
+    def after_request(self, response):
+        if response.status_code < 200 or response.status_code in (204, 304) or response.direct_passthrough \
+                or 'Content-Encoding' in response.headers or not response.mimetype.startswith(COMPRESSIBLE):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = negotiate_encoding(request)
+        if encoding == 'identity' or response.content_length is not None and response.content_length < self.min_size:
+            return response
+        data = response.get_data()
+        if len(data) < self.min_size:
+            return response
+        response.set_data(compress(data, encoding, self.level))
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+
+if __name__ == '__main__':
+    import json
+    from flask import Flask
+    app = Flask(__name__)
+    Compression(app)
+
+    @app.route('/')
+    def index():
+        return {'values': list(range(10000))}, 200
+
+    client = app.test_client()
+    plain = client.get('/')
+    compressed = client.get('/', headers={'Accept-Encoding': 'gzip, zstd'})
+    print(len(plain.data), compressed.headers['Content-Encoding'], len(compressed.data))
+    print(json.loads(gzip.decompress(client.get('/', headers={'Accept-Encoding': 'gzip'}).data)) == plain.json)
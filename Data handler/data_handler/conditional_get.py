@@ -0,0 +1,52 @@
+"""
+Client side of the ETags of the data handler and the correlation service: the last parsed responses are held with their ETags,
+and a repeated request is sent with If-None-Match, so that an unchanged response is neither transferred nor parsed again.
+
+This module is maintained here for the services that request data (correlation, visualization), which are built separately:
+their copies are replaced with this file by sync_shared.sh (also run by install.sh before the images are built), so only this file is edited.
+"""
+
+
+__author__ = 'Erik Aumayr'
+
+
+from collections import OrderedDict
+from threading import Lock
+import json
+import requests
+
+
+class ConditionalGet:
+    """
+    Least-recently-used store of the last size parsed responses, shared by the threads of a process.
+    """
+
+    def __init__(self, size=16):
+        self.size = size
+        self.received = OrderedDict()
+        self.lock = Lock()
+
+
+    def get(self, link, params, parse=lambda r: r.text):
+        """
+        Returns the ETag (or None) and the parsed response of a GET request, using a conditional request
+        if the response of an earlier identical request is held. Only successful responses with an ETag are held.
+        """
+        key = (link, json.dumps(params, sort_keys=True))
+        with self.lock:
+            held = self.received.get(key)
+        r = requests.get(link, params=params, headers={'If-None-Match': held[0]} if held else {})
+        if r.status_code == 304 and held:
+            with self.lock:
+                self.received[key] = held
+                self.received.move_to_end(key)
+            return held
+        result = parse(r)
+        etag = r.headers.get('ETag')
+        if r.status_code == 200 and etag:
+            with self.lock:
+                self.received[key] = (etag, result)
+                self.received.move_to_end(key)
+                while len(self.received) > self.size:
+                    self.received.popitem(last=False)
+        return etag, result
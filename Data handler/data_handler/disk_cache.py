@@ -0,0 +1,153 @@
+"""
+Persistent on-disk cache tier for the data retrieved by the data handler. Data frames are stored as Parquet files
+in a local directory, with a manifest index that keeps track of the cached entries and their last access.
+The directory belongs to the single process of the data handler, which loads the manifest again after a restart.
+"""
+
+
+__author__ = 'Erik Aumayr'
+
+
+from threading import RLock
+import os
+import time
+import pandas as pd
+from data_handler.snapshots import write_json, read_json
+
+
+MANIFEST = 'manifest.json'
+
+
+class DiskCache:
+    """
+    Least-recently-used Parquet cache with a size cap on the cache directory.
+    Parameters:
+    directory   path of the cache directory, created if it does not exist
+    max_bytes   size cap for all cached files together
+    ttl         time to live of an entry in seconds after it has been written (None for no expiry)
+    """
+
+    def __init__(self, directory, max_bytes=10 * 1024**3, ttl=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.lock = RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        os.makedirs(directory, exist_ok=True)
+        self.manifest = read_json(os.path.join(directory, MANIFEST)) or {}
+
+
+    def get(self, key, columns=None):
+        """
+        Reads a cached data frame. With columns, only these columns are read from the file (column projection).
+        Returns None if the key is not cached or does not contain all requested columns.
+        """
+        with self.lock:
+            entry = self.manifest.get(key)
+            if entry is not None and self.ttl is not None and time.time() - entry.get('created', entry['last_access']) > self.ttl:
+                self._remove(key)
+                self._save_manifest()
+                self.expirations += 1
+                entry = None
+            if entry is None or (columns and not set(columns).issubset(entry['columns'])):
+                self.misses += 1
+                return None
+            path = os.path.join(self.directory, entry['file'])
+            try:
+                df = pd.read_parquet(path, columns=columns or None)
+            except (OSError, ValueError) as e:  # File removed or corrupted outside the manifest
+                print(e, flush=True)
+                self._remove(key)
+                self._save_manifest()
+                self.misses += 1
+                return None
+            entry['last_access'] = time.time()
+            self.hits += 1
+            return df
+
+
+    def put(self, key, df, datasource=None, experimentId=None):
+        if df is None or df.empty:
+            return False
+        file_name = key + '.parquet'
+        path = os.path.join(self.directory, file_name)
+        with self.lock:
+            df.to_parquet(f'{path}.tmp')
+            os.replace(f'{path}.tmp', path)
+            self.manifest[key] = {
+                'file': file_name,
+                'size': os.path.getsize(path),
+                'created': time.time(),
+                'last_access': time.time(),
+                'columns': [str(column) for column in df.columns],
+                'datasource': datasource,
+                'experimentId': str(experimentId)
+            }
+            self._evict()
+            self._save_manifest()
+        return True
+
+
+    def invalidate(self, datasource=None, experimentId=None):
+        with self.lock:
+            keys = [key for key, entry in self.manifest.items()
+                    if (datasource is None or entry['datasource'] == datasource)
+                    and (experimentId is None or entry['experimentId'] == str(experimentId))]
+            for key in keys:
+                self._remove(key)
+            self._save_manifest()
+        return len(keys)
+
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.manifest),
+                'bytes': sum(entry['size'] for entry in self.manifest.values()),
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations
+            }
+
+
+    def _evict(self):
+        size = sum(entry['size'] for entry in self.manifest.values())
+        for key in sorted(self.manifest, key=lambda key: self.manifest[key]['last_access']):
+            if size <= self.max_bytes:
+                break
+            size -= self.manifest[key]['size']
+            self._remove(key)
+            self.evictions += 1
+
+
+    def _remove(self, key):
+        entry = self.manifest.pop(key)
+        try:
+            os.remove(os.path.join(self.directory, entry['file']))
+        except FileNotFoundError:
+            pass
+
+
+    def _save_manifest(self):
+        write_json(os.path.join(self.directory, MANIFEST), self.manifest)
+
+
+if __name__ == '__main__':
+    import tempfile
+    cache = DiskCache(tempfile.mkdtemp(), max_bytes=20000)
+    df = pd.DataFrame({'a': range(100), 'b': range(100)}, index=pd.date_range('2021-01-01', periods=100, freq='s', name='time'))
+    for i in range(5):
+        cache.put(f'uma_{i}', df, datasource='uma', experimentId=i)
+    print(cache.get('uma_4', columns=['b']))
+    print(cache.stats())
+    restarted = DiskCache(cache.directory, max_bytes=20000)
+    print(restarted.get('uma_4') is not None, restarted.stats()['entries'])
+    expiring = DiskCache(tempfile.mkdtemp(), ttl=0)
+    expiring.put('uma_0', df, datasource='uma', experimentId=0)
+    print(expiring.get('uma_0'), expiring.stats()['expirations'])
@@ -0,0 +1,114 @@
+"""
+Shape-preserving downsampling of measurement time series, e.g. for plotting large experiments.
+
+Two methods are available:
+
+lttb:   Largest-Triangle-Three-Buckets, selects the point of each bucket that forms the largest triangle with its neighbours
+minmax: selects the minimum and the maximum of each bucket
+
+Input: dataframe,
+       max_points (maximum number of points per column),
+       method(default='lttb')
+
+Output: dataframe with the rows that contain the selected points of any numeric column, index maintained;
+        the values of a numeric column that were not selected for it are NaN, so each column keeps at most max_points values
+"""
+
+__author__ = 'Erik Aumayr'
+
+import numpy as np
+import pandas as pd
+
+
+def lttb(x, y, n_out):
+    """
+    Returns the positions of the n_out points selected by Largest-Triangle-Three-Buckets. First and last point are always kept.
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    every = (n - 2) / (n_out - 2)
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+        areas = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(areas))
+        selected[i + 1] = a
+    return selected
+
+
+def minmax(x, y, n_out):
+    """
+    Returns the positions of the minimum and maximum of n_out / 2 equally sized buckets.
+    """
+    n = len(y)
+    buckets = n_out // 2
+    if n_out >= n or buckets < 1:
+        return np.arange(n)
+    size = -(-n // buckets)  # Ceiling division
+    padded = np.full(buckets * size, np.nan)
+    padded[:n] = y
+    padded = padded.reshape(buckets, size)
+    offsets = np.arange(buckets) * size
+    valid = ~np.all(np.isnan(padded), axis=1)  # The last buckets may only contain padding
+    padded = padded[valid]
+    offsets = offsets[valid]
+    positions = np.concatenate([offsets + np.nanargmin(padded, axis=1), offsets + np.nanargmax(padded, axis=1)])
+    return np.unique(positions)
+
+
+METHODS = {'lttb': lttb, 'minmax': minmax}
+MIN_POINTS = {'lttb': 3, 'minmax': 2}  # First, last and one selected point; minimum and maximum of one bucket
+
+
+def check(max_points, method='lttb'):
+    """
+    Raises a ValueError for an unknown method or a max_points (None for no limit) that the method cannot reduce the data to.
+    """
+    if method not in METHODS:
+        raise ValueError(f'Downsampling method {method} is not supported. Use {" or ".join(METHODS)}.')
+    if max_points is not None and max_points < MIN_POINTS[method]:
+        raise ValueError(f'max_points must be at least {MIN_POINTS[method]} for {method}.')
+
+
+def downsample(data, max_points, method='lttb'):
+    """
+    Downsamples each numeric column to at most max_points points and returns the union of the selected rows,
+    in which every numeric column only keeps the values selected for it (the others are NaN).
+    """
+    check(max_points, method)
+    if len(data) <= max_points:
+        return data
+    if isinstance(data.index, (pd.DatetimeIndex, pd.TimedeltaIndex)):
+        x = data.index.asi8.astype(float)
+    else:
+        x = np.arange(len(data), dtype=float)
+    selected = {}
+    for column in data.select_dtypes(include='number').columns:
+        y = data[column].to_numpy(dtype=float)
+        valid = np.flatnonzero(~np.isnan(y))
+        selected[column] = valid[METHODS[method](x[valid], y[valid], max_points)]
+    if not selected:
+        return data.iloc[:max_points]
+    rows = np.unique(np.concatenate(list(selected.values())))
+    result = data.iloc[rows].copy()
+    for column, positions in selected.items():
+        result[column] = result[column].where(np.isin(rows, positions))
+    return result
+
+
+# Test input
+if __name__ == '__main__':
+    df = pd.DataFrame({
+        'a': np.sin(np.linspace(0, 20, 100000)) + np.random.normal(0, 0.1, 100000),
+        'b': np.cumsum(np.random.normal(0, 1, 100000))
+    }, index=pd.date_range('2021-01-01', periods=100000, freq='100ms'))
+    print(downsample(df, 1000, 'lttb').count().to_dict())
+    print(downsample(df, 1000, 'minmax').count().to_dict())
@@ -0,0 +1,159 @@
+"""
+Thread-safe in-memory index of the experiment IDs (ExecutionIds) that are available in a database, in both directions:
+the experiment IDs of each measurement and the measurements of each experiment ID (ExecutionId or ExperimentId tag).
+"""
+
+
+__author__ = 'Erik Aumayr'
+
+
+from threading import RLock
+import bisect
+
+
+class ExperimentIndex:
+
+    def __init__(self):
+        self.lock = RLock()
+        self.experimentIds = []  # Sorted list of all experiment IDs
+        self.experiments_by_measurement = {}
+        self.experiment_tags_by_measurement = {}  # Values of the ExperimentId tag, which are not listed as experiment IDs
+        self.measurements_by_experiment = {}  # Reverse index of both
+        self.measurements_total = 0
+        self.measurements_done = 0
+        self.ready = False
+        self.error = None
+        self.watermark = None  # Time (ns) up to which the data has been indexed
+        self.last_refresh = None
+
+
+    def start(self, measurements_total):
+        with self.lock:
+            self.measurements_total = measurements_total
+            self.measurements_done = 0
+
+
+    def add(self, measurement, experimentIds, done=True):
+        """
+        Merges the experiment IDs of a measurement into the index. With done=True, the measurement counts towards the progress of the index build.
+        """
+        with self.lock:
+            known = self.experiments_by_measurement.setdefault(measurement, set())
+            for experimentId in experimentIds:
+                experimentId = str(experimentId)
+                if experimentId in known:
+                    continue
+                known.add(experimentId)
+                self.measurements_by_experiment.setdefault(experimentId, set()).add(measurement)
+                position = bisect.bisect_left(self.experimentIds, experimentId)
+                if position == len(self.experimentIds) or self.experimentIds[position] != experimentId:
+                    self.experimentIds.insert(position, experimentId)
+            if done:
+                self.measurements_done += 1
+
+
+    def add_experiment_tags(self, measurement, experimentIds):
+        """
+        Merges values of the ExperimentId tag of a measurement, which only select the measurement (see get_measurements).
+        """
+        with self.lock:
+            known = self.experiment_tags_by_measurement.setdefault(measurement, set())
+            for experimentId in experimentIds:
+                experimentId = str(experimentId)
+                if experimentId not in known:
+                    known.add(experimentId)
+                    self.measurements_by_experiment.setdefault(experimentId, set()).add(measurement)
+
+
+    def finish(self, error=None):
+        with self.lock:
+            self.error = str(error) if error else None
+            self.ready = error is None
+
+
+    def get_all(self):
+        with self.lock:
+            return list(self.experimentIds)
+
+
+    def get_by_measurement(self):
+        with self.lock:
+            return {measurement: set(experimentIds) for measurement, experimentIds in self.experiments_by_measurement.items()}
+
+
+    def get_measurements(self, experimentId):
+        """
+        Returns the sorted measurements whose ExecutionId or ExperimentId tag equals the experiment ID,
+        or None if the index is not ready or does not know the experiment ID (yet).
+        """
+        with self.lock:
+            if not self.ready or experimentId not in self.measurements_by_experiment:
+                return None
+            return sorted(self.measurements_by_experiment[experimentId])
+
+
+    def get_experimentIds(self, measurement):
+        """
+        Returns the sorted experiment IDs of a measurement, or None if the index is not ready or does not know the measurement (yet).
+        """
+        with self.lock:
+            if not self.ready or measurement not in self.experiments_by_measurement:
+                return None
+            return sorted(self.experiments_by_measurement[measurement])
+
+
+    def snapshot(self):
+        """
+        Returns the index as a JSON-serialisable dictionary, to share it with other processes (see restore).
+        """
+        with self.lock:
+            return {
+                'experiments_by_measurement': {measurement: sorted(experimentIds) for measurement, experimentIds in self.experiments_by_measurement.items()},
+                'experiment_tags_by_measurement': {measurement: sorted(experimentIds) for measurement, experimentIds in self.experiment_tags_by_measurement.items()},
+                'measurements_total': self.measurements_total,
+                'measurements_done': self.measurements_done,
+                'ready': self.ready,
+                'error': self.error,
+                'watermark': self.watermark,
+                'last_refresh': self.last_refresh
+            }
+
+
+    def restore(self, snapshot):
+        with self.lock:
+            self.experiments_by_measurement = {measurement: set(experimentIds) for measurement, experimentIds in snapshot['experiments_by_measurement'].items()}
+            self.experiment_tags_by_measurement = {measurement: set(experimentIds) for measurement, experimentIds in snapshot.get('experiment_tags_by_measurement', {}).items()}
+            self.experimentIds = sorted(set().union(*self.experiments_by_measurement.values()))
+            self.measurements_by_experiment = {}
+            for mapping in (self.experiments_by_measurement, self.experiment_tags_by_measurement):
+                for measurement, experimentIds in mapping.items():
+                    for experimentId in experimentIds:
+                        self.measurements_by_experiment.setdefault(experimentId, set()).add(measurement)
+            for attribute in ('measurements_total', 'measurements_done', 'ready', 'error', 'watermark', 'last_refresh'):
+                setattr(self, attribute, snapshot[attribute])
+
+
+    def progress(self):
+        with self.lock:
+            return {
+                'ready': self.ready,
+                'measurements_done': self.measurements_done,
+                'measurements_total': self.measurements_total,
+                'experimentIds': len(self.experimentIds),
+                'error': self.error,
+                'last_refresh': self.last_refresh
+            }
+
+
+if __name__ == '__main__':
+    index = ExperimentIndex()
+    index.start(2)
+    index.add('Throughput_Measures', [499, 12, 520])
+    index.add('ADB_Ping_Agent', ['520', '101_1'])
+    index.add_experiment_tags('ADB_Ping_Agent', ['101'])
+    index.finish()
+    print(index.get_all(), index.progress())
+    print(index.get_measurements('520'), index.get_measurements('101'), index.get_measurements('7'), index.get_experimentIds('ADB_Ping_Agent'))
+    copy = ExperimentIndex()
+    copy.restore(index.snapshot())
+    print(copy.get_all(), copy.get_by_measurement(), copy.get_measurements('101'))
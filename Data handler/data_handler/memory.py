@@ -0,0 +1,114 @@
+"""
+Keeps the memory footprint of the data collected by the data handler predictable: compaction of the data types
+of the collected data frames and a per-request budget on their number of rows and bytes.
+"""
+
+
+__author__ = 'Erik Aumayr'
+
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+class MemoryBudget:
+    """
+    Parameters:
+    max_rows    maximum number of rows of the data of a request (None for no limit)
+    max_bytes   maximum memory of the data of a request in bytes (None for no limit)
+    policy      error to reject requests that exceed the budget, or aggregate to aggregate their data in InfluxDB instead
+    """
+
+    def __init__(self, max_rows=None, max_bytes=None, policy='error'):
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.policy = policy
+
+
+    def check(self, rows, nbytes):
+        if self.max_rows is not None and rows > self.max_rows or self.max_bytes is not None and nbytes > self.max_bytes:
+            limits = ', '.join(limit for limit in (f'{self.max_rows} rows' if self.max_rows is not None else None,
+                                                   f'{self.max_bytes / 1024**2:.0f} MB' if self.max_bytes is not None else None) if limit)
+            raise BudgetExceeded(f'The requested data ({rows} rows, {nbytes / 1024**2:.1f} MB so far) exceeds the budget of {limits} per request. '
+                                 'Select fewer measurements or fields, use pushdown=true, a coarser max_lag, a time range (start, end) or pagination (page_size).')
+
+
+    def check_frame(self, df):
+        self.check(len(df), int(df.memory_usage(index=True, deep=True).sum()))
+
+
+def compact(df, float32=False, category_ratio=0.5):
+    """
+    Returns the data frame with smaller data types where this is lossless: integers are downcast to the smallest integer type,
+    floats to float32 if all values are exactly representable (or in any case with float32=True), and text columns
+    with few distinct values (e.g. tags like ExecutionId or host names) are stored as categoricals.
+    """
+    columns = {}
+    for column in df.columns:
+        series = df[column]
+        if pd.api.types.is_bool_dtype(series):
+            continue
+        if pd.api.types.is_integer_dtype(series):
+            compacted = pd.to_numeric(series, downcast='integer')
+        elif pd.api.types.is_float_dtype(series) and series.dtype != np.float32:
+            compacted = series.astype(np.float32)
+            if not float32:
+                narrow, wide = compacted.to_numpy(dtype=np.float64), series.to_numpy(dtype=np.float64)
+                if not ((narrow == wide) | (np.isnan(narrow) & np.isnan(wide))).all():  # array_equal(equal_nan=True) needs numpy >= 1.19
+                    continue
+        elif pd.api.types.is_object_dtype(series) and len(series) and series.nunique() <= category_ratio * len(series):
+            compacted = series.astype('category')
+        else:
+            continue
+        if compacted.dtype != series.dtype:
+            columns[column] = compacted
+    if not columns:
+        return df
+    df = df.copy(deep=False)
+    for column, compacted in columns.items():
+        df[column] = compacted
+    return df
+
+
+def concat(chunks, **kwargs):
+    """
+    Concatenates compacted data frames (see compact), e.g. the chunks of a response. Text columns that are categorical in any chunk
+    are combined with the union of their categories, as pd.concat would otherwise fall back to object if the categories differ.
+    """
+    if len(chunks) < 2:
+        return pd.concat(chunks, **kwargs)
+    categorical = {column for chunk in chunks for column in chunk.columns if isinstance(chunk[column].dtype, pd.CategoricalDtype)}
+    categorical = [column for column in categorical
+                   if all(column not in chunk.columns or isinstance(chunk[column].dtype, pd.CategoricalDtype) or pd.api.types.is_object_dtype(chunk[column]) for chunk in chunks)]
+    if categorical:
+        chunks = [chunk.copy(deep=False) for chunk in chunks]
+        for column in categorical:
+            for chunk in chunks:
+                if column in chunk.columns and not isinstance(chunk[column].dtype, pd.CategoricalDtype):
+                    chunk[column] = chunk[column].astype('category')
+            categories = union_categoricals([chunk[column] for chunk in chunks if column in chunk.columns]).categories
+            for chunk in chunks:
+                if column in chunk.columns:
+                    chunk[column] = chunk[column].cat.set_categories(categories)
+    return pd.concat(chunks, **kwargs)
+
+
+if __name__ == '__main__':
+    df = pd.DataFrame({
+        'Throughput (Mbps)': np.random.normal(100, 10, 10000),
+        'Packets': np.arange(10000.0),
+        '_iteration_': np.arange(10000) // 1000,
+        'ExecutionId': ['499'] * 10000
+    })
+    print(df.memory_usage(deep=True).sum(), compact(df).memory_usage(deep=True).sum())
+    print(compact(df).dtypes)
+    print(concat([compact(df.iloc[:5000]), compact(df.iloc[5000:].assign(ExecutionId='520'))], ignore_index=True).dtypes['ExecutionId'])
+    try:
+        MemoryBudget(max_rows=1000).check_frame(df)
+    except BudgetExceeded as e:
+        print(e)
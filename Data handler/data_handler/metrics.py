@@ -0,0 +1,172 @@
+"""
+Metrics of the data handler in the Prometheus text exposition format: counters, gauges and histograms with labels,
+and the timings of the stages of a request (InfluxDB query, CSV parsing, time bucketing, synchronisation, outlier removal, encoding).
+"""
+
+
+__author__ = 'Erik Aumayr'
+
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
+from timeit import default_timer as timer
+import bisect
+import math
+
+
+REGISTRY = []
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Endpoint of the request that is handled in the current context, as label of the stage timings (background for the index)
+endpoint = ContextVar('endpoint', default='background')
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+
+def format_value(value):
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+
+    def __init__(self, name, documentation, labelnames=(), kind='untyped', register=True):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.kind = kind
+        self.lock = Lock()
+        self.values = {}
+        if register:
+            REGISTRY.append(self)
+
+
+    def key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} has the labels {", ".join(self.labelnames)}, got {", ".join(labels)}')
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+
+    def samples(self):
+        """
+        Returns (suffix, labels, value) for each sample of the metric.
+        """
+        with self.lock:
+            return [('', dict(zip(self.labelnames, key)), value) for key, value in sorted(self.values.items())]
+
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        lines += [f'{self.name}{suffix}{format_labels(labels)} {format_value(value)}' for suffix, labels, value in self.samples()]
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+
+    def __init__(self, name, documentation, labelnames=(), register=True):
+        super().__init__(name, documentation, labelnames, 'counter', register)
+
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+
+    def __init__(self, name, documentation, labelnames=(), register=True):
+        super().__init__(name, documentation, labelnames, 'gauge', register)
+
+
+    def set(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = value
+
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+
+    def __init__(self, name, documentation, labelnames=(), buckets=BUCKETS, register=True):
+        super().__init__(name, documentation, labelnames, 'histogram', register)
+        self.buckets = tuple(sorted(buckets))
+
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.values[key] = (counts, total + value)
+
+
+    @contextmanager
+    def time(self, **labels):
+        start = timer()
+        try:
+            yield
+        finally:
+            self.observe(timer() - start, **labels)
+
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            for key, (counts, total) in sorted(self.values.items()):
+                labels = dict(zip(self.labelnames, key))
+                cumulative = 0
+                for bound, count in zip(self.buckets + (math.inf,), counts):
+                    cumulative += count
+                    samples.append(('_bucket', {**labels, 'le': format_value(float(bound))}, cumulative))
+                samples.append(('_sum', labels, total))
+                samples.append(('_count', labels, cumulative))
+        return samples
+
+
+def render(metrics=()):
+    """
+    Returns all registered metrics and the given (unregistered) metrics in the Prometheus text format.
+    """
+    return '\n'.join(metric.render() for metric in REGISTRY + list(metrics)) + '\n'
+
+
+# Metrics of the data handler
+STAGE_SECONDS = Histogram('data_handler_stage_seconds', 'Duration of the stages of data requests in seconds.', ['stage', 'datasource', 'endpoint'])
+REQUEST_SECONDS = Histogram('data_handler_request_seconds', 'Duration of HTTP requests in seconds.', ['endpoint', 'status'])
+IN_FLIGHT = Gauge('data_handler_requests_in_flight', 'Number of HTTP requests that are currently handled.', ['endpoint'])
+INFLUX_ERRORS = Counter('data_handler_influx_errors_total', 'Number of failed InfluxDB queries.', ['datasource', 'error'])
+INDEX_LOOKUPS = Counter('data_handler_index_lookups_total', 'Number of metadata lookups answered by the experiment index (hit) or by a live query (miss).', ['datasource', 'lookup', 'result'])
+
+
+def stage(name, datasource):
+    """
+    Measures the duration of a stage of the request that is handled in the current context.
+    """
+    return STAGE_SECONDS.time(stage=name, datasource=datasource, endpoint=endpoint.get())
+
+
+if __name__ == '__main__':
+    import time
+    with stage('influx_query', 'uma_test'):
+        time.sleep(0.02)
+    INFLUX_ERRORS.inc(datasource='uma_test', error='ReadTimeout')
+    cache_bytes = Gauge('data_handler_cache_bytes', 'Memory used by the cache in bytes.', ['cache'], register=False)
+    cache_bytes.set(1024, cache='raw')
+    print(render([cache_bytes]))
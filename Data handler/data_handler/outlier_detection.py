@@ -1,23 +1,37 @@
 """
 Detects and Remove outliers in a DataFrame
 
-Three different cases available:
+Different cases available:
 
 0: Z-score based outlier detection
 1: Median Absolute Deviation (MAD)-score based outlier detection
+2: Rolling Z-score based outlier detection over a trailing window
+3: Hampel filter, rolling median and MAD over a trailing window
+4: MAD-score based outlier detection per iteration (grouped by _iteration_)
 
 Input: dataframe,
        mode(default=0)
 
+The group column (_iteration_) and the experiment tags are not scored (EXCLUDED), since every step of these
+piecewise constant columns would be flagged; further columns, e.g. tags of the measurements, can be excluded as well.
+
 Output: dataframe with a boolean column indicating if the values is either outlier or not
         dataframe composed of its outliers, index maintained
+        boolean series indicating the rows with outliers (outlier_mask, input not modified)
 """
 
 __author__ = 'Erik Aumayr, SRL'
 
+import numpy as np
 import pandas as pd
 
 
+MODES = {'zscore': 0, 'mad': 1, 'rolling_zscore': 2, 'hampel': 3, 'iteration_mad': 4}
+THRESHOLDS = {0: 3, 1: 3.5, 2: 3, 3: 3, 4: 3.5}
+EXCLUDED = ('_iteration_', 'ExecutionId', 'ExperimentId')
+BLOCK_SIZE = 65536  # Number of windows that are evaluated at once, bounds the memory of the window views
+
+
 def detect(data, mode=0):
 
     if mode == 0:
@@ -36,13 +50,99 @@ def detect(data, mode=0):
     return data
 
 
-def remove(data, mode=0):
-    if mode in (0, 1):
-        data = detect(data, mode)
-        data = data[~data['outliers']].drop('outliers', 1)
+def rolling_scores(values, window, mode):
+    """
+    Scores every value against the trailing window that ends with it, with vectorised NumPy operations on strided window views.
+    The first window - 1 values have no complete window and get a score of 0.
+    """
+    scores = np.zeros(len(values))
+    if len(values) < window:
+        return scores
+    windows = np.lib.stride_tricks.as_strided(values, shape=(len(values) - window + 1, window), strides=(values.strides[0],) * 2, writeable=False)
+    for start in range(0, len(windows), BLOCK_SIZE):
+        block = windows[start:start + BLOCK_SIZE]
+        current = block[:, -1]
+        if mode == 2:
+            deviation = block.std(axis=1, ddof=1)
+            distance = np.abs(current - block.mean(axis=1))
+        else:
+            median = np.median(block, axis=1)
+            deviation = 1.4826 * np.median(np.abs(block - median[:, None]), axis=1)
+            distance = np.abs(current - median)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # A constant window has no deviation, so any value that differs from it is an outlier
+            scores[window - 1 + start:window - 1 + start + len(block)] = np.where(deviation > 0, distance / deviation, np.where(distance > 0, np.inf, 0))
+    return scores
+
+
+class OutlierFilter:
+    """
+    Rolling outlier detection (modes 2 and 3) that can be applied chunk by chunk, e.g. while data is streamed from the database.
+    The last window - 1 values of each column are kept, so that the windows continue across chunks and the result is the same as for the complete data.
+    """
+
+    def __init__(self, mode=3, window=30, threshold=None, exclude=EXCLUDED):
+        if mode not in (2, 3):
+            raise ValueError(f'{mode} not valid. Only the rolling modes 2 (rolling Z-score) and 3 (Hampel) can be applied chunk by chunk.')
+        self.mode = mode
+        self.window = window
+        self.threshold = threshold if threshold is not None else THRESHOLDS[mode]
+        self.exclude = tuple(exclude)
+        self.tails = {}
+
+    def mask(self, data):
+        outliers = np.zeros(len(data), dtype=bool)
+        for column in scored(data, self.exclude).columns:
+            values = data[column].to_numpy(dtype=float)
+            positions = np.flatnonzero(~np.isnan(values))
+            tail = self.tails.get(column, np.empty(0))
+            values = np.concatenate([tail, values[positions]])
+            scores = rolling_scores(values, self.window, self.mode)[len(tail):]
+            outliers[positions[scores > self.threshold]] = True
+            self.tails[column] = values[-(self.window - 1):] if self.window > 1 else np.empty(0)
+        return pd.Series(outliers, index=data.index)
+
+
+def scored(data, exclude=EXCLUDED):
+    """
+    Returns the numeric columns of the data that are scored, without the excluded ones.
+    """
+    numeric = data.select_dtypes(include='number')
+    return numeric.drop(columns=[column for column in numeric.columns if column in exclude])
+
+
+def outlier_mask(data, mode=0, window=30, threshold=None, group='_iteration_', exclude=EXCLUDED):
+    """
+    Returns a boolean series that is True for the rows containing an outlier. The data frame is not modified.
+    """
+    threshold = threshold if threshold is not None else THRESHOLDS.get(mode)
+    numeric = scored(data, exclude)
+    if mode == 0:
+        zscores = (numeric - numeric.mean()).abs() / numeric.std()
+        return (zscores > threshold).any(axis=1)
+    elif mode == 1:
+        distance = (numeric - numeric.median()).abs()
+        zscores_MAD = 0.6745 * distance / distance.median()
+        return (zscores_MAD > threshold).any(axis=1)
+    elif mode in (2, 3):
+        return OutlierFilter(mode, window, threshold, exclude).mask(data)
+    elif mode == 4:
+        if group not in data.columns:  # Without iterations, the whole experiment is one group
+            return outlier_mask(data, 1, threshold=threshold, exclude=exclude)
+        values = numeric.drop(columns=group, errors='ignore')
+        groups = data[group]
+        distance = (values - values.groupby(groups).transform('median')).abs()
+        zscores_MAD = 0.6745 * distance / distance.groupby(groups).transform('median')
+        return (zscores_MAD > threshold).any(axis=1)
+    raise ValueError(f'{mode} not valid. Available options are: {", ".join(f"{number} for {name}" for name, number in MODES.items())}')
+
+
+def remove(data, mode=0, window=30, threshold=None, exclude=EXCLUDED):
+    if mode in MODES.values():
+        data = data[~outlier_mask(data, mode, window, threshold, exclude=exclude)]
     else:
         print(
-            f'{mode} not valid. Available options are: 0 for Z-score and 1 for MAD-score')
+            f'{mode} not valid. Available options are: {", ".join(f"{number} for {name}" for name, number in MODES.items())}')
     return data
 
 
@@ -52,4 +152,7 @@ if __name__ == '__main__':
         'a': [1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1000],
         'b': [1, 2, 3, 4, 5, 4, 3, 2, 1, 2, 3, 4, 5, 4, 3, 2, 1, 2, 3, 4]
     })
-    print(detect(df, 0))
+    print(detect(df.copy(), 0))
+    print(outlier_mask(df, 3, window=5))
+    df['_iteration_'] = np.arange(20) // 5  # Not scored, its steps are no outliers
+    print(outlier_mask(df, 3, window=5).sum())
@@ -0,0 +1,84 @@
+"""
+Thread-safe in-memory catalog of the schema of a database: the measurements, their field keys and types and their tag keys.
+Together with the experiment ID index it tells clients which KPIs exist without retrieving any data.
+"""
+
+
+__author__ = 'Erik Aumayr'
+
+
+from threading import RLock
+
+
+class SchemaCatalog:
+
+    def __init__(self):
+        self.lock = RLock()
+        self.fields = {}  # measurement -> {field key: field type}
+        self.tags = {}  # measurement -> set of tag keys
+        self.last_update = None
+
+
+    def update(self, field_keys=None, tag_keys=None):
+        """
+        Merges the results of SHOW FIELD KEYS (columns name, fieldKey, fieldType) and SHOW TAG KEYS (columns name, tagKey)
+        into the catalog. Keys are only added, so that repeated updates are cheap and never lose information.
+        """
+        with self.lock:
+            if field_keys is not None and not field_keys.empty:
+                for measurement, field, field_type in field_keys[['name', 'fieldKey', 'fieldType']].itertuples(index=False):
+                    self.fields.setdefault(measurement, {})[field] = field_type
+            if tag_keys is not None and not tag_keys.empty:
+                for measurement, tag in tag_keys[['name', 'tagKey']].itertuples(index=False):
+                    self.tags.setdefault(measurement, set()).add(tag)
+
+
+    def tag_keys(self):
+        """
+        Returns the tag keys of all measurements.
+        """
+        with self.lock:
+            return set().union(*self.tags.values())
+
+
+    def snapshot(self):
+        with self.lock:
+            return {'fields': {measurement: dict(fields) for measurement, fields in self.fields.items()},
+                    'tags': {measurement: sorted(tags) for measurement, tags in self.tags.items()},
+                    'last_update': self.last_update}
+
+
+    def restore(self, snapshot):
+        with self.lock:
+            self.fields = {measurement: dict(fields) for measurement, fields in snapshot['fields'].items()}
+            self.tags = {measurement: set(tags) for measurement, tags in snapshot['tags'].items()}
+            self.last_update = snapshot['last_update']
+
+
+    def get(self, measurements=None, experiments_by_measurement=None):
+        """
+        Returns the schema of the given measurements (all by default). With experiments_by_measurement (see ExperimentIndex),
+        the experiment IDs in which each measurement appears are added.
+        """
+        with self.lock:
+            names = sorted(set(self.fields) | set(self.tags)) if measurements is None else measurements
+            schema = {}
+            for measurement in names:
+                if measurement not in self.fields and measurement not in self.tags:
+                    continue
+                schema[measurement] = {
+                    'fields': dict(self.fields.get(measurement, {})),
+                    'tags': sorted(self.tags.get(measurement, set()))
+                }
+                if experiments_by_measurement is not None:
+                    schema[measurement]['experiments'] = sorted(experiments_by_measurement.get(measurement, set()))
+            return schema
+
+
+if __name__ == '__main__':
+    import pandas as pd
+    catalog = SchemaCatalog()
+    catalog.update(
+        field_keys=pd.DataFrame({'name': ['ADB_Ping_Agent', 'ADB_Ping_Agent'], 'fieldKey': ['Delay', 'Success'], 'fieldType': ['float', 'boolean']}),
+        tag_keys=pd.DataFrame({'name': ['ADB_Ping_Agent'], 'tagKey': ['ExecutionId']}))
+    print(catalog.get(experiments_by_measurement={'ADB_Ping_Agent': {'101_1', '520'}}))
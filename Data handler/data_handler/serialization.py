@@ -0,0 +1,81 @@
+"""
+Encoding of the data frames returned by the data handler. JSON is the default, binary columnar formats
+(Arrow IPC stream or Parquet) preserve the time index and the data types and avoid the text round trip.
+"""
+
+
+__author__ = 'Erik Aumayr'
+
+
+from io import BytesIO
+import hashlib
+import pandas as pd
+import pyarrow as pa
+
+
+MIMETYPES = {
+    'json': 'application/json',
+    'arrow': 'application/vnd.apache.arrow.stream',
+    'parquet': 'application/vnd.apache.parquet'
+}
+
+
+def negotiate_format(request):
+    """
+    Returns the requested response format: the format parameter takes precedence over the Accept header.
+    Returns None if the format parameter is not supported. JSON is preferred for unspecific Accept headers (e.g. */*).
+    """
+    requested = request.args.get('format')
+    if requested:
+        requested = requested.lower()
+        return requested if requested in MIMETYPES else None
+    best_match = request.accept_mimetypes.best_match(list(MIMETYPES.values()), default=MIMETYPES['json'])
+    return next(name for name, mimetype in MIMETYPES.items() if mimetype == best_match)
+
+
+def to_frame(data, level='series'):
+    """
+    Combines a dictionary of data frames (e.g. of different experiments) into a single data frame with an additional index level (series by default).
+    """
+    if isinstance(data, dict):
+        if not data:
+            return pd.DataFrame()
+        return pd.concat(data, names=[level])
+    return data
+
+
+def encode(data, response_format='arrow', level='series'):
+    """
+    Encodes a data frame or a dictionary of data frames in a binary format (arrow or parquet).
+    """
+    df = to_frame(data, level)
+    if not all(isinstance(column, str) for column in df.columns):
+        df = df.rename(columns=str)
+    sink = BytesIO()
+    if response_format == 'parquet':
+        df.to_parquet(sink)
+    else:
+        table = pa.Table.from_pandas(df, preserve_index=True)
+        writer = pa.ipc.new_stream(sink, table.schema)
+        writer.write_table(table)
+        writer.close()
+    return sink.getvalue()
+
+
+def fingerprint(data):
+    """
+    Returns a hash of the contents of a data frame or a dictionary of data frames: index, columns, data types and values.
+    """
+    digest = hashlib.sha256()
+    frames = data.items() if isinstance(data, dict) else [(None, data)]
+    for name, df in sorted(frames, key=lambda item: str(item[0])):
+        digest.update(repr((name, list(df.columns), [str(dtype) for dtype in df.dtypes])).encode())
+        digest.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+if __name__ == '__main__':
+    df = pd.DataFrame({'a': [1.5, 2.5], 'b': [1, 2]}, index=pd.to_datetime([1579768919241000000, 1579768920241000000]).rename('time'))
+    print(pa.ipc.open_stream(encode(df, 'arrow')).read_pandas().dtypes)
+    print(pd.read_parquet(BytesIO(encode({'series1': df, 'series2': df}, 'parquet'))))
+    print(fingerprint(df) == fingerprint(df.copy()), fingerprint(df) == fingerprint(df * 2))
@@ -0,0 +1,67 @@
+"""
+Coalescing of identical concurrent requests: while a request for a key is in flight, further requests for the same key
+wait for its result instead of running their own query.
+"""
+
+
+__author__ = 'Erik Aumayr'
+
+
+from concurrent.futures import Future
+from threading import Lock
+
+
+class SingleFlight:
+
+    def __init__(self):
+        self.lock = Lock()
+        self.in_flight = {}
+        self.executed = 0
+        self.coalesced = 0
+
+
+    def do(self, key, function, *args, **kwargs):
+        """
+        Calls function(*args, **kwargs) unless a call with the same key is already running, in which case its result
+        (or exception) is shared. The result must not be modified by the callers.
+        """
+        with self.lock:
+            future = self.in_flight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                future = Future()
+                self.in_flight[key] = future
+                self.executed += 1
+                leader = True
+        if not leader:
+            return future.result()
+        try:
+            result = function(*args, **kwargs)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+
+
+    def stats(self):
+        with self.lock:
+            return {
+                'executed': self.executed,
+                'coalesced': self.coalesced,
+                'in_flight': len(self.in_flight)
+            }
+
+
+if __name__ == '__main__':
+    from concurrent.futures import ThreadPoolExecutor
+    import time
+    flight = SingleFlight()
+    with ThreadPoolExecutor(max_workers=5) as executor:
+        results = list(executor.map(lambda _: flight.do('uma_499', time.sleep, 0.5), range(5)))
+    print(flight.stats())
@@ -0,0 +1,39 @@
+"""
+Atomically replaced JSON snapshots, in which the data handler keeps state across restarts
+(the experiment ID index and schema of a data source, the manifest of the disk cache).
+"""
+
+
+__author__ = 'Erik Aumayr'
+
+
+import json
+import os
+
+
+def write_json(path, data):
+    """
+    Writes the data to a JSON file, replacing it atomically so that a restart never finds a partial file.
+    """
+    temporary = f'{path}.tmp'
+    with open(temporary, 'w') as json_file:
+        json.dump(data, json_file)
+    os.replace(temporary, path)
+
+
+def read_json(path):
+    """
+    Returns the content of a JSON file, or None if it does not exist or cannot be read.
+    """
+    try:
+        with open(path, 'r') as json_file:
+            return json.load(json_file)
+    except (IOError, ValueError):
+        return None
+
+
+if __name__ == '__main__':
+    import tempfile
+    directory = tempfile.mkdtemp()
+    write_json(os.path.join(directory, 'uma.json'), {'experimentIds': ['499', '520']})
+    print(read_json(os.path.join(directory, 'uma.json')), read_json(os.path.join(directory, 'missing.json')))
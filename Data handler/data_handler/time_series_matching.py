@@ -4,6 +4,7 @@
 __author__ = 'Erik Aumayr'
 
 
+import numpy as np
 import pandas as pd
 
 
@@ -35,6 +36,48 @@ def synchronize(dataframes, max_lag='1s', merge=False):
         return dataframes
 
 
+"""
+Aligning measurement data points from different measurements with a single sorted as-of match of all series at once.
+In contrast to synchronize, the time values are not floored, so that matching data points on either side of a bucket boundary are not lost,
+and the input data frames are not modified.
+Input: Expects a dictionary of Pandas measurement dataframes as input, e.g. {'SMU': df1, 'Throughput Measures': df2}, or a single dataframe whose columns are aligned
+Output: A Pandas data frame of matched and merged data points, or separate dataframes that share the same time index
+Parameters:
+dataframes  dictionary that contains Pandas data frames of different measurement series as specified above
+tolerance   the maximum distance between matching data points. 1 second (1s) by default
+direction   nearest (default) matches the closest data point, backward the closest previous one and forward the closest following one
+merge       with merge=True, a merged data frame will be returned, otherwise separate dataframes will be returned
+"""
+def align(dataframes, tolerance='1s', direction='nearest', merge=False):
+    if isinstance(dataframes, pd.DataFrame):
+        dataframes = {column: dataframes[[column]].dropna() for column in dataframes.columns}
+    methods = {'nearest': 'nearest', 'backward': 'pad', 'forward': 'backfill'}
+    series = {}
+    for series_name, df in dataframes.items():
+        if not df.index.is_unique:
+            df = df[~df.index.duplicated(keep='last')]
+        if not df.index.is_monotonic_increasing:
+            df = df.sort_index()
+        series[series_name] = df
+    if not series:
+        return {'series': pd.DataFrame()} if merge else {}
+    # Every matched point contains one point per series, so the series with the fewest points is the reference time line
+    reference = min(series.values(), key=len).index
+    positions = {}
+    for series_name, df in series.items():
+        positions[series_name] = df.index.get_indexer(reference, method=methods[direction], tolerance=pd.Timedelta(tolerance))
+    matched = np.logical_and.reduce([position >= 0 for position in positions.values()])
+    time = reference[matched]
+    aligned = {series_name: df.iloc[positions[series_name][matched]].set_axis(time, axis=0) for series_name, df in series.items()}
+    if merge:
+        columns = pd.Series([column for df in aligned.values() for column in df.columns])
+        duplicated = set(columns[columns.duplicated()])
+        merged = pd.concat([df.rename(columns=lambda column: f'{column} [{series_name}]' if column in duplicated else column)
+                            for series_name, df in aligned.items()], axis=1)
+        return {'series': merged}
+    return aligned
+
+
 if __name__ == '__main__':
 
     # Test data
@@ -67,4 +110,5 @@ if __name__ == '__main__':
     series_b.index = pd.to_datetime(series_b.index)
     series_c = pd.DataFrame(c).set_index('time')
     series_c.index = pd.to_datetime(series_c.index)
+    print(align(dataframes={'series_a': series_a, 'series_b': series_b, 'series_c': series_c}, tolerance='1s', merge=True))
     print(synchronize(dataframes={'series_a': series_a, 'series_b': series_b, 'series_c': series_c}, max_lag='1s', merge=True))
@@ -1,13 +1,15 @@
 from flask import Flask, request
 import json
 import urllib
-import pandas as pd
+import pyarrow as pa
 from feature_selection.RFE import RFE_selector
 from feature_selection.backward_elimination import backward_elimination
 from feature_selection.LASSO import LASSO
+from feature_selection.compression import Compression
 
 
 app = Flask(__name__)
+Compression(app)
 
 
 @app.route('/', methods=['GET'])
@@ -51,12 +53,10 @@ def selection(datasource, algorithm, target):
     remove_outliers = request.args.get('remove_outliers')
     normalize = request.args.get('normalize')
 
-    series = pd.DataFrame()
-    for experimentId in experimentIds:
-        with urllib.request.urlopen(f'http://data_handler:5000/get_data/{datasource}/{experimentId}?match_series=false&remove_outliers={remove_outliers}{measurements}') as response:
-            data = json.loads(response.read())
-        series = series.append(pd.DataFrame(data).reset_index(drop=True))
-        # series = series.append(pd.DataFrame(data['series']))
+    experiments = ("&experimentid="+"&experimentid=".join(experimentIds)) if experimentIds else ""
+    # All experiments are retrieved with one request
+    with urllib.request.urlopen(f'http://data_handler:5000/get_data_batch/{datasource}?match_series=false&format=arrow&remove_outliers={remove_outliers}{experiments}{measurements}') as response:
+        series = pa.ipc.open_stream(response.read()).read_pandas().reset_index(drop=True)
 
     if algorithm in ['backward', 'backward_elimination']:
         new_features, original_features,score = backward_elimination(series, target=target, drop_features=drop_features)
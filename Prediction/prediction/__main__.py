@@ -1,17 +1,45 @@
 __author__ = 'Erik Aumayr'
 
 from flask import Flask, request, send_file
+import os
+import tempfile
 import json
 import requests
-import pandas as pd
+import pyarrow as pa
 from prediction.regression import linear_regression
 from prediction.random_forest import random_forest
 from prediction.SVR import svr, linear_svr, nu_svr
+from prediction.compression import Compression
 import pickle
 from io import BytesIO
 
 
 app = Flask(__name__)
+Compression(app)
+
+# The last trained model is kept in a file, so that every worker process can serve it
+model_path = os.path.join(os.environ.get('MODEL_DIR', tempfile.gettempdir()), 'last_trained_model.pickle')
+
+
+def save_model(last_trained_model):
+    if not last_trained_model:
+        try:
+            os.remove(model_path)
+        except FileNotFoundError:
+            pass
+        return
+    temporary = f'{model_path}.{os.getpid()}.tmp'
+    with open(temporary, 'wb') as model_file:
+        pickle.dump(last_trained_model, model_file)
+    os.replace(temporary, model_path)
+
+
+def load_model():
+    try:
+        with open(model_path, 'rb') as model_file:
+            return pickle.load(model_file)
+    except (IOError, pickle.UnpicklingError, EOFError):
+        return None
 
 
 @app.route('/', methods=['GET'])
@@ -42,6 +70,7 @@ def get_help():
 
 @app.route("/model")
 def download_model():
+    last_trained_model = load_model()
     if not last_trained_model:
         return {"warning": "No trained model available."}, 200
     pickled_model_string = pickle.dumps(last_trained_model[1])
@@ -55,8 +84,8 @@ def download_model():
 
 @app.route("/train/<string:datasource>/<string:algorithm>/<string:target>")
 def predict(datasource, algorithm, target):
-    global last_trained_model
     last_trained_model = None
+    save_model(last_trained_model)
     experimentIds = request.args.getlist('experimentid')
     if not experimentIds or experimentIds == []:
         return {"error": "Must specify at least one experimentId with experimentid=123."}, 400
@@ -69,18 +98,18 @@ def predict(datasource, algorithm, target):
     coefficients = None
     results = None
     y_values = None
-    series = pd.DataFrame()
-    for experimentId in experimentIds:
-        param_dict = {
-            'measurement': measurements,
-            'drop_feature': drop_features,
-            'remove_outliers': remove_outliers,
-            'normalize': normalize,
-            'max_lag': max_lag
-        }
-        r = requests.get(f'http://data_handler:5000/get_data/{datasource}/{experimentId}', params=param_dict)
-        data = r.json()
-        series = series.append(pd.DataFrame(data).reset_index(drop=True))
+    param_dict = {
+        'experimentid': experimentIds,
+        'measurement': measurements,
+        'drop_feature': drop_features,
+        'remove_outliers': remove_outliers,
+        'normalize': normalize,
+        'max_lag': max_lag,
+        'format': 'arrow'
+    }
+    # All experiments are retrieved with one request
+    r = requests.get(f'http://data_handler:5000/get_data_batch/{datasource}', params=param_dict)
+    series = pa.ipc.open_stream(r.content).read_pandas().reset_index(drop=True)
     if algorithm in ['linreg', 'linear_regression']:
         coefficients, results, y_values, model = linear_regression(
             series, target=target, drop_features=drop_features, split=0.2, normalize=normalize)
@@ -101,9 +130,9 @@ def predict(datasource, algorithm, target):
         coefficients, results, y_values, model = nu_svr(
             series, kernel='linear', target=target, drop_features=drop_features, split=0.2)
         last_trained_model = ['Nu SVR', model]
+    save_model(last_trained_model)
     return {'coefficients': json.loads(coefficients.to_json()), 'results': json.loads(results.to_json()), 'real_predicted_values': json.loads(y_values.to_json())}, 200
 
 
 if __name__ == '__main__':
-    last_trained_model = None
     app.run(host='0.0.0.0', port=5002, debug=False)
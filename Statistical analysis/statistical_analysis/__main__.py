@@ -2,11 +2,14 @@ from flask import Flask, request
 import json
 import urllib
 import pandas as pd
+import pyarrow as pa
 from statistical_analysis.statistical_analysis import KPI_statistics
+from statistical_analysis.compression import Compression
 
 
 
 app = Flask(__name__)
+Compression(app)
 
 
 @app.route('/', methods=['GET'])
@@ -58,19 +61,26 @@ def stat(datasource):
         exp_type=0
 
     final_diz={}
+
+    if not experimentIds:
+        return {'experimentid': final_diz}, 200
+
     name1='Iteration Statistics'
     name2='Test Case Statistics'
 
-    for experimentid in experimentIds:
-        with urllib.request.urlopen(f'http://data_handler:5000/get_data/{datasource}/{experimentid}?match_series=false{measurements}') as response:
+    # All experiments are retrieved with one request, experiments without data are left out of it
+    experiments = "&experimentid="+"&experimentid=".join(experimentIds)
+    with urllib.request.urlopen(f'http://data_handler:5000/get_data_batch/{datasource}?match_series=false&partial=true&format=arrow{experiments}{measurements}') as response:
 
-            data = json.loads(response.read())
+        data = pa.ipc.open_stream(response.read()).read_pandas()
 
-        diz={}
+    experiments_data = {name: df.droplevel('experimentid') for name, df in data.groupby(level='experimentid', sort=False)} if not data.empty else {}
 
-        # for s_name, s in data.items():
+    for experimentid in experimentIds:
+
+        series = experiments_data.get(experimentid, pd.DataFrame())
 
-        series=pd.DataFrame(data)
+        diz={}
 
         diz1={}
         diz2={}
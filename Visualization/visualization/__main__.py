@@ -19,6 +19,7 @@ from datetime import datetime
 from io import BytesIO
 import jwt
 from typing import List, Tuple
+from visualization.conditional_get import ConditionalGet
 
 
 class Crypt:
@@ -117,7 +118,10 @@ app.layout = dbc.Container([
                     options=[
                         {'label': 'None', 'value': 'None'},
                         {'label': 'Z-score', 'value': 'zscore'},
-                        {'label': 'MAD', 'value': 'mad'}],
+                        {'label': 'MAD', 'value': 'mad'},
+                        {'label': 'Rolling Z-score', 'value': 'rolling_zscore'},
+                        {'label': 'Hampel filter', 'value': 'hampel'},
+                        {'label': 'MAD per iteration', 'value': 'iteration_mad'}],
                     value='None',
                     id='outlier',
                     searchable=False,
@@ -144,6 +148,7 @@ app.layout = dbc.Container([
         dbc.Col([
             # Hidden divisions to store data that'll be used as input for different callbacks
             html.Div(id='df', style={'display': 'none'}),
+            html.Div(id='graph_df', style={'display': 'none'}),
             html.Div(id='df_no_outliers', style={'display': 'none'}),
 
             html.Div(id='test_case_stat_df', style={'display': 'none'}),
@@ -468,6 +473,11 @@ kpi_filter_list = ['Available RAM', 'PacketsReceived', 'Total RAM', 'Used CPU Pe
                    'AWGN State', 'Verdict']
 
 meas_filter_list = ['execution_metadata', 'syslog']
+max_points = 5000  # per KPI in the time series graph, downsampled by the data handler
+
+# Last responses of the data handler and the correlation service with their ETags,
+# so that unchanged results are neither transferred nor parsed again
+received = ConditionalGet(size=32)
 
 
 # callback to return experiment ID options
@@ -520,7 +530,8 @@ def find_measurement(experiment, datasource):
 
 
 @app.callback(
-    Output('df', 'children'),
+    [Output('df', 'children'),
+     Output('graph_df', 'children')],
     [Input('measurement', 'value'),
      Input('outlier', 'value'),
      Input('datasource', 'value'),
@@ -531,11 +542,11 @@ def retrieve_df(measurement, outlier, datasource, experiment, time_resolution, p
     # input check - this order required (at first value is none, when filled it is a list)
     if not measurement or not experiment or not time_resolution:
         # empty_df = pd.DataFrame(data={})
-        return None
+        return None, None
     context = dash.callback_context
     if context and context.triggered[0]['prop_id'].split('.')[0] == 'purge_cache_button':
         requests.get('http://data_handler:5000/purge_cache')
-        return None
+        return None, None
 
     start = datetime.now()
     link = f'http://data_handler:5000/get_data/{datasource}/{experiment}'
@@ -545,25 +556,38 @@ def retrieve_df(measurement, outlier, datasource, experiment, time_resolution, p
         'max_lag': time_resolution,
         'remove_outliers': outlier
     }
-    r = requests.get(link, params=param_dict)
+    # The box plots and the feature lists use all data points, only the time series graph is aggregated in InfluxDB and downsampled
+    _, text = received.get(link, param_dict)
+    _, graph_text = received.get(link, {**param_dict, 'pushdown': True, 'max_points': max_points})
     print(f"-- retrieve_df: {datetime.now()-start}", flush=True)
     # return df.to_json()
-    return r.text
+    return text, graph_text
 
 
 @app.callback(
     [Output('kpi', 'options'),
      Output('kpi', 'value')],
-    [Input("df", "children")])
-def update_dropdown(df):
-    if not df:
+    [Input('measurement', 'value')],
+    [State('datasource', 'value'),
+     State('experiment', 'value')])
+def update_dropdown(measurement, datasource, experiment):
+    if not measurement or not datasource or not experiment:
         return [], None
     start = datetime.now()
+    # The KPIs are taken from the schema catalog of the data handler, without retrieving the data
+    link = f'http://data_handler:5000/get_schema/{datasource}'
+    r = requests.get(link, params={'measurement': measurement, 'experimentid': experiment, 'experiments': False})
+    schema = r.json().get('schema', {})
     temp = []
-    df = pd.read_json(df)
-    for i in df.columns:
-        if not len(df[i].dropna()) == 0 and i not in kpi_filter_list:
-            temp.append({'label': i, 'value': i})
+    for meas in schema.values():
+        for i, field_type in meas['fields'].items():
+            if field_type in ('float', 'integer') and i not in kpi_filter_list and {'label': i, 'value': i} not in temp:
+                temp.append({'label': i, 'value': i})
+    if not temp:  # The schema catalog is not complete yet (e.g. right after the data handler started), the KPIs are taken from the data
+        r = requests.get(f'http://data_handler:5000/get_data/{datasource}/{experiment}', params={'measurement': measurement, 'limit': 1})
+        if r.status_code == 200:
+            columns = pd.DataFrame(r.json()).select_dtypes(include='number').columns
+            temp = [{'label': i, 'value': i} for i in columns if i not in kpi_filter_list]
     print(f"-- update_dropdown: {datetime.now()-start}", flush=True)
     return temp, None
 
@@ -578,7 +602,7 @@ def update_dropdown(df):
     [Input('kpi', 'value'),
      Input("outlier", 'value'),
      Input('tabs', 'value')],
-    [State("df", "children")])
+    [State("graph_df", "children")])
 def update_graph(kpi, outlier, tab, df):
 
     # input check
@@ -589,11 +613,10 @@ def update_graph(kpi, outlier, tab, df):
     traces = []
     for i in range(len(kpi)):
         feature = kpi[i]
-        series = df[feature]
-        series.reset_index(drop=True, inplace=True)
+        series = df[feature].dropna()  # The data is downsampled per KPI, the other KPIs' points are empty
         traces.append(go.Scatter(
-            x=df.index,
-            y=series,
+            x=series.index,
+            y=series.values,
             mode='lines',
             name=feature,
             yaxis=f"y{i+1}" if i > 0 else 'y'
@@ -846,8 +869,7 @@ def correlation_matrix(outlier, measurement, tab, corr_tab, kpis, correlation_me
         'remove_outliers': outlier,
         'method': correlation_method
     }
-    r = requests.get(link, params=param_dict)
-    data = r.json()
+    _, data = received.get(link, param_dict, parse=lambda r: r.json())
 
     df = pd.DataFrame(data['correlation_matrix']).select_dtypes(exclude=object).dropna(how='all')
     x = df.columns
@@ -1288,7 +1310,9 @@ def get_secret():
         return None
 
 
+secret = get_secret()
+decoder = Crypt(secret=secret)
+
+
 if __name__ == '__main__':
-    secret = get_secret()
-    decoder = Crypt(secret=secret)
     app.run_server(host='0.0.0.0', port=5005, debug=False)
@@ -1,6 +1,8 @@
 #!/usr/bin/env bash
 set -xeuo pipefail
 
+./sync_shared.sh
+
 docker build --rm -t 5genesis-analytics/data-handler:0.2.8 "Data handler"
 docker build --rm -t 5genesis-analytics/correlation:0.1.5 Correlation
 docker build --rm -t 5genesis-analytics/prediction:0.1.7 Prediction
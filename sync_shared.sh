@@ -0,0 +1,31 @@
+#!/usr/bin/env bash
+# Copies the modules that are shared by the services from the data handler into the other services, which are built separately.
+# Usage: ./sync_shared.sh [--check]   (--check only lists the copies that differ and fails if there are any)
+set -euo pipefail
+cd "$(dirname "$0")"
+
+CHECK="${1:-}"
+status=0
+
+# Usage: sync <module> <package>...   copies the module into each of the packages that use it
+sync() {
+    local module="$1"
+    shift
+    for package in "$@"; do
+        copy="$package/$(basename "$module")"
+        if cmp -s "$module" "$copy"; then
+            continue
+        fi
+        if [ "$CHECK" = "--check" ]; then
+            echo "$copy differs from $module"
+            status=1
+        else
+            cp "$module" "$copy"
+            echo "Updated $copy"
+        fi
+    done
+}
+
+sync "Data handler/data_handler/compression.py" "Correlation/correlation" "Prediction/prediction" "Statistical analysis/statistical_analysis" "Feature_Selection/feature_selection"
+sync "Data handler/data_handler/conditional_get.py" "Correlation/correlation" "Visualization/visualization"
+exit $status